@@ -1,12 +1,17 @@
-from ppdpy.template_compiler import compile as compile_template, LINEBREAK
+__version__ = '0.0.1'
 
+from ppdpy.template_compiler import compile as compile_template, compile_text, \
+    compile_path, Compiler, ENGINE_INTERPRETER
+from ppdpy.loader import TemplateLoader
+from ppdpy.parallel import render_parallel
 
-def compile(file):
-    return compile_template(file)
 
+def compile(file, engine=ENGINE_INTERPRETER, cache_size=None, lazy=False, optimize=True):
+    return compile_template(file, engine, cache_size, lazy, optimize)
 
-def compiles(text):
-    return compile_template(text.split(LINEBREAK))
+
+def compiles(text, engine=ENGINE_INTERPRETER, cache_size=None, lazy=False, optimize=True):
+    return compile_text(text, engine, cache_size, lazy, optimize)
 
 
 def render(file, symbols):
@@ -19,14 +24,13 @@ def renders(text, symbols):
 
 def set_directive_prefix(prefix):
     import ppdpy.template_compiler
-    import string
+    ppdpy.template_compiler.set_directive_prefixes(prefix)
 
-    if not isinstance(prefix, str):
-        raise ValueError
 
-    allowed_chars = string.digits + string.ascii_letters + string.punctuation
-    for c in prefix:
-        if c not in allowed_chars:
-            raise ValueError
+def __getattr__(name):
+    # the asyncio support is imported on first use, as asyncio is slow to import
+    if name in ('acompile_path', 'AsyncTemplateLoader'):
+        import ppdpy.aio
+        return getattr(ppdpy.aio, name)
 
-    ppdpy.template_compiler.set_directive_prefixes(prefix)
+    raise AttributeError("module 'ppdpy' has no attribute " + repr(name))
@@ -0,0 +1,99 @@
+"""
+Asyncio support: file access and compilation run in a bounded pool of
+threads, so they do not block the event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from ppdpy.loader import TemplateLoader
+from ppdpy.template_compiler import compile_path, render_iter
+
+# Number of threads of the default executor
+MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = Lock()
+
+
+def default_executor():
+    """
+    The executor used when none is given, shared by all the loaders.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix='ppdpy')
+
+        return _executor
+
+
+async def acompile_path(path, executor=None, **options):
+    """
+    Runs compile_path(path, **options) in the executor (or the default one),
+    and returns the compiled template.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or default_executor(), partial(compile_path, path, **options))
+
+
+class AsyncTemplateLoader:
+    """
+    A TemplateLoader for asyncio code. Loading and compiling the templates
+    run in the executor (or the default one), and concurrent requests for a
+    same template share a single load.
+
+    The other arguments are passed to TemplateLoader.
+    """
+    def __init__(self, search_paths, executor=None, **options):
+        self.loader = TemplateLoader(search_paths, **options)
+        self.executor = executor
+        self._pending = {}
+
+    async def get(self, name):
+        """
+        Returns the compiled template of the given name.
+        """
+        template = self.loader.get_loaded(name)
+        if template is not None:
+            return template
+
+        future = self._pending.get(name)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor or default_executor(), self.loader.get, name)
+            self._pending[name] = future
+            future.add_done_callback(lambda _: self._pending.pop(name, None))
+
+        # a cancelled caller does not cancel the load of the other callers
+        return await asyncio.shield(future)
+
+
+async def arender_iter(template, symbols):
+    """
+    Renders a template like render_iter, yielding the text of each selected
+    block, and giving control back to the event loop between blocks.
+    """
+    for chunk in render_iter(template, symbols):
+        yield chunk
+        await asyncio.sleep(0)
+
+
+async def render_to_stream(template, writer, symbols, encoding='utf-8'):
+    """
+    Renders a template to an asyncio StreamWriter, waiting for the writer
+    to drain after each block, and returns the number of bytes written. The
+    chunks of bytes templates are written as they are.
+    """
+    written = 0
+
+    for chunk in render_iter(template, symbols):
+        data = chunk if template.binary else chunk.encode(encoding)
+        writer.write(data)
+        written += len(data)
+        await writer.drain()
+
+    return written
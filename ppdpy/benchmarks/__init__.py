@@ -0,0 +1,28 @@
+"""
+Performance benchmarks for ppdpy.
+
+Each module can be run as a script, for example:
+
+    $ python -m ppdpy.benchmarks.expressions
+
+The `suite` module measures compile and render over templates of several
+shapes, and compares the results with a saved baseline.
+"""
+import timeit
+
+
+def best_time(func, number=1000, repeat=5):
+    """
+    Runs `func` `number` times, `repeat` times over, and returns the best
+    mean time per call, in seconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds, baseline=None):
+    line = '{:<40} {:>12.3f} us'.format(name, seconds * 1e6)
+
+    if baseline:
+        line += '  ({:.1f}x)'.format(baseline / seconds)
+
+    print(line)
@@ -0,0 +1,40 @@
+"""
+Times the compilation of templates with thousands of directives, when the
+nodes of their symbols are built from scratch, and when they are interned
+already by another template, and the cost of optimizing them.
+"""
+from ppdpy import compiles
+from ppdpy.benchmarks import best_time, report
+
+
+DIRECTIVES = 5000
+
+TEMPLATES = [
+    ('5000 directives, 15000 symbols',
+     ''.join('#if a%d and not (b%d or c%d)\nline %d\n#endif\n' % (i, i, i, i) for i in range(DIRECTIVES))),
+    ('5000 directives, 30 symbols',
+     ''.join('#if a%d and not (b%d or c%d)\nline %d\n#endif\n' % (i % 10, i % 7, i % 13, i)
+             for i in range(DIRECTIVES))),
+]
+
+
+def main():
+    for name, text in TEMPLATES:
+        print(name)
+
+        # each template is dropped before the next run, so its nodes are
+        # built again
+        new_time = best_time(lambda: compiles(text), number=1, repeat=10)
+        report('  compiles', new_time)
+
+        template = compiles(text)
+        report('  compiles, symbols interned already', best_time(lambda: compiles(text), number=1, repeat=10),
+               new_time)
+        del template
+
+        report('  compiles, optimize=False', best_time(lambda: compiles(text, optimize=False), number=1, repeat=10),
+               new_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares the render time of the template engines.
+"""
+from ppdpy import compiles
+from ppdpy.benchmarks import best_time, report
+from ppdpy.template_compiler import ENGINES, ENGINE_INTERPRETER
+
+
+SQL = """select channel.id, channel.name, membership.joined_at
+#if select_unread_count
+    ,(select coalesce(count(*), 0) from messages m
+      where m.channel_id = channel.id
+        and m.sender_id != chat_user.id
+        and (last_read.id IS NULL OR m.sent_at > last_read.sent_at)
+    ) as unread_count
+#endif
+from channel
+    inner join membership
+    on membership.channel_id = channel.id
+    inner join chatuser
+    on chat_user.id = membership.chat_user_id
+#if select_unread_count
+    left join message last_read
+    on last_read.id = membership.last_read_id
+    and last_read.channel_id = channel.id
+#endif
+where chat_user.id = %(user_id)s
+#if filter_by_status
+    and channel.status = %(status_filter)s
+#endif
+order by
+#if order_by_join_date
+    membership.joined_at
+#elif order_by_readcount
+    4
+#else
+    channel.name
+#endif
+#if sort_descending
+    DESC
+#else
+    ASC
+#endif
+"""
+
+SYMBOLS = {'select_unread_count', 'order_by_readcount', 'sort_descending'}
+
+
+def main():
+    baseline = None
+
+    for engine in ENGINES:
+        template = compiles(SQL, engine)
+        seconds = best_time(lambda: template.render(SYMBOLS), number=10000)
+        report(engine, seconds, baseline)
+
+        if engine == ENGINE_INTERPRETER:
+            baseline = seconds
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Compares the tree walking `evaluate` with the compiled predicates.
+"""
+from ppdpy.benchmarks import best_time, report
+from ppdpy.bitmask import symbols_mask
+from ppdpy.expression_compiler import compile, compile_predicate, evaluate, \
+    symbols_of, compile_mask_predicate
+
+
+EXPRESSIONS = [
+    'a',
+    'a and not (b or c)',
+    'not (a and b) or c and d or e',
+    ' or '.join('symbol_%d' % i for i in range(20)),
+    ' and '.join('(a%d or not b%d)' % (i, i) for i in range(10)),
+]
+
+SYMBOLS = {'a', 'c', 'd', 'symbol_19', 'a3', 'b5'}
+
+
+def main():
+    for text in EXPRESSIONS:
+        expression = compile(text)
+        predicate = compile_predicate(expression)
+
+        print(text if len(text) < 60 else text[:57] + '...')
+        evaluate_time = best_time(lambda: evaluate(expression, SYMBOLS))
+        report('  evaluate', evaluate_time)
+        report('  compile_predicate', best_time(lambda: predicate(SYMBOLS)), evaluate_time)
+
+        symbols_bits = [(s, 1 << i) for i, s in enumerate(symbols_of(expression))]
+        mask_predicate = compile_mask_predicate(expression, dict(symbols_bits))
+        report('  compile_mask_predicate', best_time(lambda: mask_predicate(symbols_mask(symbols_bits, SYMBOLS))),
+               evaluate_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Measures how render_parallel scales with the number of worker processes.
+"""
+import os
+import random
+import time
+
+from ppdpy import compiles, render_parallel
+
+SYMBOLS = ['flag_%d' % i for i in range(16)]
+
+
+def _template():
+    lines = []
+
+    for i, symbol in enumerate(SYMBOLS):
+        lines.append('#if {} and not {}'.format(symbol, SYMBOLS[i - 1]))
+        lines.extend('    line {} of section {}'.format(j, i) for j in range(20))
+        lines.append('#elif {} or {}'.format(SYMBOLS[i - 2], SYMBOLS[i - 3]))
+        lines.extend('    other line {} of section {}'.format(j, i) for j in range(20))
+        lines.append('#endif')
+
+    return compiles('\n'.join(lines))
+
+
+def main(contexts=100000):
+    template = _template()
+    generator = random.Random(0)
+    symbols_sets = [{s for s in SYMBOLS if generator.random() < 0.5} for _ in range(contexts)]
+
+    start = time.perf_counter()
+    template.render_many(symbols_sets)
+    baseline = time.perf_counter() - start
+    print('{:<20} {:>8.3f} s'.format('render_many', baseline))
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        start = time.perf_counter()
+        render_parallel(template, symbols_sets, workers=workers, chunksize=2000)
+        seconds = time.perf_counter() - start
+        print('{:<20} {:>8.3f} s  ({:.1f}x)'.format('{} workers'.format(workers), seconds, baseline / seconds))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
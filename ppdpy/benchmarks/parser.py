@@ -0,0 +1,50 @@
+"""
+Compares the expression parser with the recursive descent parser it
+replaced, which is kept in the test helpers as a reference, and shows the
+cost of interning the symbols of the parsed expressions.
+"""
+import sys
+
+from ppdpy.benchmarks import best_time, report
+from ppdpy.expression_compiler import lex, parse
+from ppdpy.tests.helpers import recursive_parse
+
+
+EXPRESSIONS = [
+    'a',
+    'a and not (b or c)',
+    'not (a and b) or c and d or e',
+    ' or '.join('symbol_%d' % i for i in range(20)),
+    ' and '.join('(a%d or not b%d)' % (i, i) for i in range(10)),
+    ' or '.join('symbol_%d' % i for i in range(200)),
+]
+
+
+def main():
+    for text in EXPRESSIONS:
+        tokens = list(lex(text))
+
+        print(text if len(text) < 60 else text[:57] + '...')
+        recursive_time = best_time(lambda: recursive_parse(tokens), number=100)
+        report('  recursive_parse', recursive_time)
+        report('  parse', best_time(lambda: parse(tokens), number=100), recursive_time)
+
+        # the nodes of the other runs are dropped, so each run interns their
+        # symbols again: the difference is the cost of interning new symbols
+        interned = parse(tokens)
+        report('  parse, symbols interned already', best_time(lambda: parse(tokens), number=100), recursive_time)
+        del interned
+
+    tokens = list(lex(' or '.join('s%d' % i for i in range(50000))))
+    print('100k tokens')
+    report('  parse', best_time(lambda: parse(tokens), number=1))
+
+    try:
+        recursive_parse(tokens)
+
+    except RecursionError:
+        print('  recursive_parse: recursion limit ({}) exceeded'.format(sys.getrecursionlimit()))
+
+
+if __name__ == '__main__':
+    main()
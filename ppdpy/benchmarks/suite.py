@@ -0,0 +1,259 @@
+"""
+Times the compile and render phases over synthetic templates of several
+shapes, and records their peak memory.
+
+The results are written as JSON, and can be compared with the results of a
+previous run to find regressions:
+
+    $ python -m ppdpy.benchmarks.suite --output baseline.json
+    $ python -m ppdpy.benchmarks.suite --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from dataclasses import dataclass, asdict
+from random import Random
+
+from ppdpy import compiles
+from ppdpy.benchmarks import best_time
+from ppdpy.expression_compiler import lex, parse
+from ppdpy.template_compiler import ENGINES, ENGINE_INTERPRETER
+
+
+@dataclass(frozen=True)
+class Shape:
+    """
+    The parameters of a synthetic template.
+
+    `directives` conditionals are written one after the other, each nesting
+    another one in its #if entry down to `depth` levels, with `elif_chain`
+    #elif entries. Every entry has `text_lines` lines of text, and every
+    expression has `expression_size` operands, drawn from `symbols` symbols.
+    """
+    name: str
+    text_lines: int = 5
+    directives: int = 20
+    depth: int = 1
+    elif_chain: int = 0
+    expression_size: int = 2
+    symbols: int = 8
+
+
+SHAPES = [
+    Shape('small'),
+    Shape('text_heavy', text_lines=200),
+    Shape('many_directives', directives=1000),
+    Shape('deep', directives=5, depth=20),
+    Shape('long_elif_chain', elif_chain=50),
+    Shape('large_expressions', expression_size=50, symbols=32),
+    Shape('many_symbols', symbols=256),
+]
+
+# Times are compared on this fraction of the baseline by default
+THRESHOLD = 0.1
+
+# Number of random symbols sets rendered per run
+RENDER_SETS = 100
+
+
+def generate_template(shape, seed=0):
+    """
+    Builds the text of a template of the given shape. The same seed always
+    gives the same text.
+    """
+    random = Random(seed)
+    symbols = ['symbol_%d' % i for i in range(shape.symbols)]
+    lines = []
+
+    def _expression():
+        operands = []
+
+        for i in range(shape.expression_size):
+            operand = random.choice(symbols)
+            operands.append('not ' + operand if random.random() < 0.25 else operand)
+
+            if i % 3 == 2:
+                # groups the last operands, so expressions have parens
+                operands[-3:] = ['(' + ' or '.join(operands[-3:]) + ')']
+
+        return ' and '.join(operands)
+
+    def _text(level):
+        indent = '    ' * level
+        lines.extend('{}line {} of the text at {}'.format(indent, i, len(lines)) for i in range(shape.text_lines))
+
+    def _conditional(level, depth):
+        indent = '    ' * level
+        lines.append(indent + '#if ' + _expression())
+        _text(level + 1)
+
+        if depth > 1:
+            _conditional(level + 1, depth - 1)
+            _text(level + 1)
+
+        for _ in range(shape.elif_chain):
+            lines.append(indent + '#elif ' + _expression())
+            _text(level + 1)
+
+        lines.append(indent + '#endif')
+
+    _text(0)
+    for _ in range(shape.directives):
+        _conditional(0, shape.depth)
+        _text(0)
+
+    return '\n'.join(lines)
+
+
+def _expressions(text):
+    return [line.split(' ', 1)[1] for line in map(str.strip, text.split('\n'))
+            if line.startswith(('#if ', '#elif '))]
+
+
+def _peak_memory(func):
+    """
+    Calls `func` and returns the peak size, in bytes, of the memory it
+    allocated.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def _fresh_compile_peak_memory(text, engine):
+    """
+    The peak memory of compiling a text in a new interpreter, where none of
+    its symbols are interned and no expression is cached yet, as in the
+    first compile of a template.
+    """
+    script = ('import sys\n'
+              'from ppdpy import compiles\n'
+              'from ppdpy.benchmarks.suite import _peak_memory\n'
+              'text = sys.stdin.read()\n'
+              'print(_peak_memory(lambda: compiles(text, sys.argv[1])))\n')
+    # the new interpreter imports ppdpy from the same paths as this one
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    process = subprocess.run([sys.executable, '-c', script, engine], input=text, env=env,
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return int(process.stdout)
+
+
+def measure(shape, engine=ENGINE_INTERPRETER, number=5, repeat=3):
+    """
+    Measures each phase on a template of the given shape. Times are the best
+    mean time per call, in seconds; render times are per rendered symbols set.
+    The compile peak memory is measured in a new process, as the symbols of
+    the template are interned already in this one.
+    """
+    text = generate_template(shape)
+    expressions = _expressions(text)
+    tokens = [lex(expression) for expression in expressions]
+
+    random = Random(1)
+    symbols = ['symbol_%d' % i for i in range(shape.symbols)]
+    symbols_sets = [{s for s in symbols if random.random() < 0.5} for _ in range(RENDER_SETS)]
+
+    template = compiles(text, engine)
+    render_all = lambda: [template.render(symbols_set) for symbols_set in symbols_sets]
+
+    return {
+        'lex': best_time(lambda: [lex(expression) for expression in expressions], number, repeat),
+        'parse': best_time(lambda: [parse(t) for t in tokens], number, repeat),
+        'compile': best_time(lambda: compiles(text, engine), number, repeat),
+        # the cost of the optimizer is the difference with 'compile'
+        'compile_unoptimized': best_time(lambda: compiles(text, engine, optimize=False), number, repeat),
+        'render': best_time(render_all, number, repeat) / len(symbols_sets),
+        'compile_peak_memory': _fresh_compile_peak_memory(text, engine),
+        'render_peak_memory': _peak_memory(lambda: template.render(symbols_sets[0])),
+    }
+
+
+def run(shapes=SHAPES, engine=ENGINE_INTERPRETER, number=5, repeat=3):
+    """
+    Measures every shape, returning the JSON serializable results.
+    """
+    return {
+        'python': platform.python_version(),
+        'engine': engine,
+        'shapes': {shape.name: dict(asdict(shape), results=measure(shape, engine, number, repeat))
+                   for shape in shapes},
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Lists the (shape, metric, baseline value, current value) of the metrics
+    that grew more than `threshold` (a fraction) over the baseline. Shapes and
+    metrics missing from either side are ignored.
+    """
+    regressions = []
+
+    for name, shape in results['shapes'].items():
+        baseline_shape = baseline['shapes'].get(name)
+        if baseline_shape is None:
+            continue
+
+        for metric, value in shape['results'].items():
+            baseline_value = baseline_shape['results'].get(metric)
+
+            if baseline_value and value > baseline_value * (1 + threshold):
+                regressions.append((name, metric, baseline_value, value))
+
+    return regressions
+
+
+def _format(metric, value):
+    if metric.endswith('_memory'):
+        return '{:.1f} KiB'.format(value / 1024)
+
+    return '{:.3f} us'.format(value * 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--output', help='writes the results to this file instead of printing them')
+    parser.add_argument('--compare', metavar='BASELINE', help='compares the results with a saved results file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='the fraction a metric can grow over the baseline (default: %(default)s)')
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_INTERPRETER)
+    parser.add_argument('--shape', action='append', choices=[shape.name for shape in SHAPES],
+                        help='measures only this shape (can be repeated)')
+    args = parser.parse_args(argv)
+
+    shapes = [shape for shape in SHAPES if not args.shape or shape.name in args.shape]
+    results = run(shapes, args.engine)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        for name, metric, baseline_value, value in regressions:
+            print('{:<20} {:<20} {:>14} -> {:>14}  ({:+.0%})'.format(
+                name, metric, _format(metric, baseline_value), _format(metric, value), value / baseline_value - 1))
+
+        if regressions:
+            return 1
+
+        print('no regressions')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Bitmask engine: each symbol referenced by a template is assigned a bit at
+compile time. A render turns the caller's symbols into a single integer mask,
+testing only the referenced symbols, and the expressions are evaluated as
+integer bit tests.
+"""
+from ppdpy.expression_compiler import compile_mask_predicate
+from ppdpy.template_compiler import TextBlock, ConditionalBlock, LazyBlock, \
+    LINEBREAK, referenced_symbols
+
+
+def assign_bits(blocks):
+    """
+    Maps each symbol referenced by the blocks to a distinct bit.
+    """
+    return {symbol: 1 << i for i, symbol in enumerate(referenced_symbols(blocks))}
+
+
+def symbols_mask(symbols_bits, symbols):
+    """
+    Returns the mask of the given symbols, where `symbols_bits` is a
+    sequence of (symbol, bit) pairs.
+    """
+    mask = 0
+    for symbol, bit in symbols_bits:
+        if symbol in symbols:
+            mask |= bit
+
+    return mask
+
+
+def _translate(blocks, bits):
+    """
+    Translates a block list to a list of strings and conditionals, where
+    each conditional is a list of (mask predicate, translated blocks) pairs.
+    """
+    program = []
+
+    for block in blocks:
+        if isinstance(block, TextBlock):
+            if block.text:
+                program.append(block.text)
+
+        elif isinstance(block, ConditionalBlock):
+            program.append([(compile_mask_predicate(expression, bits), _translate(inner_blocks, bits))
+                            for expression, inner_blocks in block.if_entries])
+
+        elif isinstance(block, LazyBlock):
+            program.extend(_translate(block.blocks, bits))
+
+        else:
+            raise ValueError('unexpected block type')
+
+    return program
+
+
+def _run(program, mask, append):
+    for item in program:
+        if item.__class__ is not list:
+            append(item)
+
+        else:
+            for predicate, inner_program in item:
+                if predicate(mask):
+                    _run(inner_program, mask, append)
+                    break
+
+
+def build_renderer(blocks, binary=False):
+    """
+    Returns a function that renders the given blocks (of a bytes template,
+    with `binary`) from a set of symbols.
+    """
+    empty = b'' if binary else ''
+    bits = assign_bits(blocks)
+    symbols_bits = tuple(bits.items())
+    program = _translate(blocks, bits)
+
+    def render(symbols):
+        parts = []
+        _run(program, symbols_mask(symbols_bits, symbols), parts.append)
+        return empty.join(parts)[:-len(LINEBREAK)]
+
+    return render
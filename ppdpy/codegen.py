@@ -0,0 +1,108 @@
+"""
+Code generation engine: translates a whole block tree to the source of a
+single Python function, made of straight-line appends of constant text and
+if/elif/else statements for the conditional blocks.
+"""
+from ppdpy.expression_compiler import to_source, TrueNode
+from ppdpy.template_compiler import TextBlock, ConditionalBlock, LazyBlock, \
+    LINEBREAK, _interpret
+
+INDENT = '    '
+
+_FUNCTION_NAME = 'render'
+_SYMBOLS = 'symbols'
+_APPEND = 'append'
+
+
+def generate_source(blocks, binary=False):
+    """
+    Returns the source of a function that renders the given blocks (of a
+    bytes template, with `binary`).
+    """
+    empty = b'' if binary else ''
+    lines = [
+        'def {}({}):'.format(_FUNCTION_NAME, _SYMBOLS),
+        INDENT + 'parts = []',
+        INDENT + '{} = parts.append'.format(_APPEND),
+    ]
+
+    _generate_blocks(blocks, INDENT, lines, empty)
+
+    lines.append(INDENT + "return {!r}.join(parts)[:-{}]".format(empty, len(LINEBREAK)))
+    return '\n'.join(lines) + '\n'
+
+
+def _generate_blocks(blocks, indent, lines, empty):
+    """
+    Appends the statements of a block list to `lines`. Returns False when
+    no statement was generated, so the caller can emit a `pass`.
+    """
+    generated = False
+    pending_text = []
+
+    def _flush_text():
+        text = empty.join(pending_text)
+        pending_text.clear()
+
+        if text:
+            lines.append(indent + '{}({!r})'.format(_APPEND, text))
+
+    stack = [iter(blocks)]
+
+    while stack:
+        block = next(stack[-1], None)
+
+        if block is None:
+            stack.pop()
+
+        elif isinstance(block, TextBlock):
+            pending_text.append(block.text)
+            generated |= bool(block.text)
+
+        elif isinstance(block, LazyBlock):
+            stack.append(iter(block.blocks))
+
+        elif isinstance(block, ConditionalBlock):
+            _flush_text()
+            _generate_conditional(block, indent, lines, empty)
+            generated = True
+
+        else:
+            raise ValueError('unexpected block type')
+
+    _flush_text()
+    return generated
+
+
+def _generate_conditional(block, indent, lines, empty):
+    keyword = 'if'
+
+    for expression, inner_blocks in block.if_entries:
+        if keyword == 'elif' and isinstance(expression, TrueNode):
+            lines.append(indent + 'else:')
+
+        else:
+            lines.append(indent + '{} {}:'.format(keyword, to_source(expression, _SYMBOLS)))
+
+        if not _generate_blocks(inner_blocks, indent + INDENT, lines, empty):
+            lines.append(indent + INDENT + 'pass')
+
+        keyword = 'elif'
+
+
+def build_renderer(blocks, binary=False):
+    """
+    Generates, compiles and returns the render function of the given blocks.
+    Falls back to the tree walking renderer when the Python compiler can not
+    handle the generated source (for very deeply nested templates).
+    """
+    namespace = {'__builtins__': {}}
+
+    try:
+        code = compile(generate_source(blocks, binary), '<ppdpy template>', 'exec')
+
+    except (SyntaxError, RecursionError, MemoryError):
+        return lambda symbols: _interpret(blocks, symbols, binary)
+
+    exec(code, namespace)
+    return namespace[_FUNCTION_NAME]
@@ -0,0 +1,132 @@
+"""
+Persistent cache of compiled templates.
+
+Each cache file holds a header and two pickles: the key of the compiled
+source, and the compiled block tree. The key is made of the hash of the
+source bytes, the ppdpy and Python versions, the directive prefix and the
+compile options, so a cached tree is only used for the exact same source
+and compiler. The source buffer itself is not stored: the lazy blocks keep
+referring to the buffer given when the tree is loaded.
+
+Cache files are unpickled when loaded, so the cache directory should only be
+writable by trusted users.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+MAGIC = b'PPDPYC'
+FORMAT_VERSION = 6
+
+SUFFIX = '.ppdc'
+
+_HEADER = MAGIC + FORMAT_VERSION.to_bytes(2, 'little')
+_SOURCE_ID = 'source'
+
+
+def cache_file(cache_dir, path, prefix, encoding, lazy, optimize=True):
+    """
+    The path of the cache file of a source file, compiled with the given
+    directive prefix and options.
+    """
+    name = '\0'.join((os.path.abspath(path), prefix, encoding, str(lazy), str(optimize)))
+    return os.path.join(cache_dir, hashlib.sha256(name.encode('utf-8')).hexdigest() + SUFFIX)
+
+
+def source_key(buffer, prefix, encoding, lazy, optimize=True):
+    """
+    The key that identifies a compiled source.
+    """
+    from ppdpy import __version__
+
+    return {
+        'source_sha256': hashlib.sha256(buffer).hexdigest(),
+        'ppdpy_version': __version__,
+        'python': sys.implementation.cache_tag,
+        'prefix': prefix,
+        'encoding': encoding,
+        'lazy': lazy,
+        'optimize': optimize,
+    }
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, buffer):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.buffer = buffer
+
+    def persistent_id(self, obj):
+        return _SOURCE_ID if obj is self.buffer else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, buffer):
+        super().__init__(file)
+        self.buffer = buffer
+
+    def persistent_load(self, pid):
+        if pid != _SOURCE_ID:
+            raise pickle.UnpicklingError('unknown persistent id')
+
+        return self.buffer
+
+
+def load(file_path, key, buffer):
+    """
+    Loads the block tree stored in a cache file, bound to the given source
+    buffer. Returns None when the file is missing, invalid or stale.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            if f.read(len(_HEADER)) != _HEADER:
+                return None
+
+            if pickle.load(f) != key:
+                return None
+
+            return _Unpickler(f, buffer).load()
+
+    except Exception:
+        # a broken cache file is the same as a missing one
+        return None
+
+
+def save(file_path, key, blocks, buffer):
+    """
+    Stores a block tree in a cache file. The predicates of the conditionals
+    are compiled before, so they are stored too. Failures, to write the file
+    or to pickle the tree, are ignored: the source is compiled again next
+    time.
+    """
+    from ppdpy.template_compiler import ConditionalBlock
+
+    stack = list(blocks)
+    while stack:
+        block = stack.pop()
+
+        if isinstance(block, ConditionalBlock):
+            for _, inner_blocks in block.compiled_entries:
+                stack.extend(inner_blocks)
+
+    directory = os.path.dirname(file_path)
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER)
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                _Pickler(f, buffer).dump(blocks)
+
+            os.replace(temp_path, file_path)
+
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    except Exception:
+        pass
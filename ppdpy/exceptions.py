@@ -9,3 +9,8 @@ class DirectiveSyntaxError(PpdPyError):
 class ExpressionSyntaxError(PpdPyError):
     def __init__(self, message:str='invalid expression syntax'):
         self.message = message
+
+
+class TemplateNotFoundError(PpdPyError):
+    def __init__(self, message:str='template not found'):
+        self.message = message
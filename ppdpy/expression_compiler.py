@@ -1,6 +1,10 @@
+import marshal
+import re
 from dataclasses import dataclass
+from itertools import product
+from types import FunctionType
+from weakref import ref, WeakKeyDictionary
 from ppdpy.exceptions import ExpressionSyntaxError
-from ppdpy.utility import listview
 
 LP = '('
 RP = ')'
@@ -11,250 +15,911 @@ TK_NOT = 'not'
 
 
 def compile(x):
-    return parse(list(lex(x)))
+    return parse(lex(x))
 
 
 def lex(text:str):
     """
     Splits a text to a list of tokens.
     """
-    def _clear(token):
-        tl = token.lower()
-        return tl if tl in (TK_AND, TK_OR, TK_NOT) else token
+    get = _OPERATORS.get
+    return [get(token, token) for token in _TOKEN.findall(text)]
 
-    token = ''
 
-    for char in text:
-        if char == ' ':
-            if token:
-                yield _clear(token)
-                token = ''
+# only spaces and parens separate tokens, any other character is part of an id
+_TOKEN = re.compile(r'[()]|[^ ()]+')
 
-            continue
+# operators are case insensitive: maps every spelling of them to the lowercase
+_OPERATORS = {
+    ''.join(spelling): operator
+    for operator in (TK_AND, TK_OR, TK_NOT)
+    for spelling in product(*((c, c.upper()) for c in operator))
+}
 
-        elif char == LP:
-            if token:
-                yield _clear(token)
-                token = ''
 
-            yield LP
+def parse(tokens):
+    """
+    Parses a list of tokens to an expression tree.
+    The tokens are read in a single pass, keeping the pending operands and
+    operators in stacks, so long expressions do not hit the recursion limit.
+    """
+    if len(tokens) == 0:
+        raise ExpressionSyntaxError('empty expression')
 
-        elif char == RP:
-            if token:
-                yield _clear(token)
-                token = ''
+    operands = []
+    operators = []
+    expecting = _EXPRESSION
 
-            yield RP
+    def _reduce(until):
+        # applies the stacked binary operators of precedence `until` and above
+        while operators and operators[-1] in until:
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(And(left, right) if operators.pop() == TK_AND else Or(left, right))
 
-        else:
-            token += char
+    def _push_operand(node):
+        # "not" applies only to the ID or parens group that follows it
+        if operators and operators[-1] == TK_NOT:
+            operators.pop()
+            node = Not(node)
 
-    if token:
-        yield _clear(token)
-        token = ''
+        operands.append(node)
 
+    for token in tokens:
+        if expecting is _OPERATOR:
+            if token == TK_AND:
+                # "and" binds early (left associative)
+                _reduce(_AND_OPERATORS)
+                operators.append(TK_AND)
+                expecting = _AND_OPERAND
 
-def parse(tokens):
-    try:
-        if len(tokens) == 0:
-            raise ExpressionSyntaxError('empty expression')
+            elif token == TK_OR:
+                # "or" binds late (right associative, low precedence)
+                _reduce(_AND_OPERATORS)
+                operators.append(TK_OR)
+                expecting = _EXPRESSION
 
-        node, remainder = _parse_expr(listview(tokens))
+            elif token == RP:
+                _reduce(_BINARY_OPERATORS)
 
-        if remainder:
-            raise ExpressionSyntaxError()
+                if not operators:
+                    raise ExpressionSyntaxError()
 
-        return node
+                operators.pop()
+                _push_operand(operands.pop())
 
-    except StopIteration:
-        raise ExpressionSyntaxError
+            else:
+                raise ExpressionSyntaxError()
 
+        elif token == LP:
+            operators.append(LP)
+            expecting = _EXPRESSION
 
-def _parse_expr(tokens):
-    """
-    Tries to parse a new expression, beginning with the left side of it.
-    """
-    head, tail = tokens.walk()
+        elif token == TK_NOT and expecting is not _NOT_OPERAND:
+            operators.append(TK_NOT)
+            expecting = _NOT_OPERAND
 
-    if head == TK_NOT:
-        # parses: not TOKEN
-        return _parse_expr_not(tail)
+        elif _is_id(token):
+            _push_operand(Id(token))
+            expecting = _OPERATOR
 
-    elif head == LP:
-        # parses: (EXPRESSION)
-        node, remainder = _parse_parens_contents(tokens)
-        return _parse_cont(node, remainder)
+        elif expecting is _EXPRESSION:
+            raise ExpressionSyntaxError('error parsing expression beginning')
 
-    elif _is_id(head):
-        # parses: ID
-        node = _parse_id(head)
-        return _parse_cont(node, tail)
+        elif expecting is _AND_OPERAND:
+            raise ExpressionSyntaxError('unexpected token after and')
 
-    else:
-        raise ExpressionSyntaxError('error parsing expression beginning')
+        else:
+            raise ExpressionSyntaxError()
+
+    if expecting is not _OPERATOR:
+        raise ExpressionSyntaxError()
 
+    _reduce(_BINARY_OPERATORS)
 
-def _parse_expr_not(tokens):
-    head = tokens.head
+    if operators:
+        raise ExpressionSyntaxError('right parens expected')
 
-    if _is_id(head):
-        # parses: not ID
-        node = Not(_parse_id(head))
-        return _parse_cont(node, tokens.tail)
+    return operands[0]
 
-    elif head == LP:
-        # parses: not (EXPRESSION)
-        node, remainder = _parse_parens_contents(tokens)
-        return _parse_cont(Not(node), remainder)
 
-    else:
-        raise ExpressionSyntaxError()
+# parser states: the kind of token expected next
+_EXPRESSION = 'expression'
+_AND_OPERAND = 'and operand'
+_NOT_OPERAND = 'not operand'
+_OPERATOR = 'operator'
+
+_AND_OPERATORS = (TK_AND,)
+_BINARY_OPERATORS = (TK_AND, TK_OR)
+
+
+def _is_id(token:str) -> bool:
+    assert isinstance(token, str)
+    return token not in (LP, RP, TK_NOT, TK_AND, TK_OR)
 
 
-def _parse_cont(left, tokens):
+class Node:
     """
-    Tries to parse an operator and the right side of the expression.
+    Base class of the expression nodes.
+
+    Nodes are immutable. Id nodes are interned: building an Id of a symbol
+    that has one already returns the existing one, so each symbol is a single
+    shared object. The other nodes compare and hash by structure, and their
+    hash is computed once, when built, so equal expressions are cheap keys
+    for the caches of simplified and compiled expressions.
     """
-    if len(tokens) == 0:
-        # nothing left to parse
-        return left, []
+    __slots__ = ('_hash', '__weakref__')
 
-    head, tail = tokens.walk()
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # the setters of the fields and the hash, which bypass the frozen
+        # __setattr__
+        cls._setters = tuple(getattr(cls, field).__set__ for field in cls.__slots__) + (Node._hash.__set__, )
 
-    if head == RP:
-        # found a closing parens
-        return left, tokens
+    def __hash__(self):
+        return self._hash
 
-    elif head == TK_OR:
-        # parses: LEFT or RIGHT
-        # does a late binding on "left or right" (low precedence)
-        right, remainder = _parse_expr(tail)
-        return Or(left, right), remainder
+    def __eq__(self, other):
+        if self is other:
+            return True
 
-    elif head == TK_AND:
-        # parses: LEFT and RIGHT
-        return _parse_cont_and(left, tail)
+        return type(other) is type(self) and other._hash == self._hash and _same(self, other)
 
-    else:
-        raise ExpressionSyntaxError()
+    def __copy__(self):
+        return self
 
+    def __deepcopy__(self, memo):
+        return self
 
-def _parse_cont_and(left, tokens):
-    # parses: LEFT and RIGHT
-    # Does an early binding on "left and right" (high precedence)
-    head, tail = tokens.walk()
+    def __reduce__(self):
+        # pickled as a postfix list, so deep expressions do not hit the
+        # recursion limit of pickle
+        return _from_postfix, (_postfix(self), )
 
-    if _is_id(head):
-        # parses: LEFT and ID
-        right = _parse_id(head)
-        node = And(left, right)
-        return _parse_cont(node, tail)
 
-    elif head == LP:
-        # parses: LEFT and (EXPRESSION)
-        right, remainder = _parse_parens_contents(tokens)
-        node = And(left, right)
-        return _parse_cont(node, remainder)
+def _postfix(node):
+    """
+    The postfix list of an expression: the symbols of its Id nodes, and the
+    classes of its other nodes after their operands.
+    """
+    result = []
+    stack = [node]
 
-    elif head == TK_NOT:
-        head2 = tail.head
+    while stack:
+        node = stack.pop()
 
-        if _is_id(head2):
-            # parses: LEFT and not ID
-            right = Not(_parse_id(head2))
-            node = And(left, right)
-            return _parse_cont(node, tail.tail)
+        if isinstance(node, Id):
+            result.append(node.id)
+            continue
 
-        elif head2 == LP:
-            # parses: LEFT and not (EXPRESSION)
-            right, remainder = _parse_parens_contents(tail)
-            node = And(left, Not(right))
-            return _parse_cont(node, remainder)
+        result.append(type(node))
+
+        if isinstance(node, Not):
+            stack.append(node.node)
+
+        elif isinstance(node, (And, Or)):
+            stack.append(node.left)
+            stack.append(node.right)
+
+    result.reverse()
+    return result
+
+
+def _from_postfix(postfix):
+    """
+    Builds an expression from its postfix list.
+    """
+    stack = []
+
+    for item in postfix:
+        if isinstance(item, str):
+            stack.append(Id(item))
+
+        elif item is Not:
+            stack.append(Not(stack.pop()))
+
+        elif item is And or item is Or:
+            right = stack.pop()
+            stack.append(item(stack.pop(), right))
 
         else:
-            raise ExpressionSyntaxError()
+            stack.append(item())
 
-    else:
-        raise ExpressionSyntaxError('unexpected token after and')
+    node, = stack
+    return node
 
 
-def _parse_parens_contents(tokens):
-    head, tail = tokens.walk()
+def _same(node, other):
+    """
+    Compares the structure of two expressions with a stack, so deep
+    expressions do not hit the recursion limit.
+    """
+    stack = [(node, other)]
 
-    if head != LP:
-        raise ExpressionSyntaxError('left parens expected')
+    while stack:
+        node, other = stack.pop()
 
-    node, remainder = _parse_expr(tail)
-    if not remainder:
-        raise ExpressionSyntaxError('right parens expected')
+        if node is other:
+            continue
 
-    elif remainder.head == RP:
-        return node, remainder.tail
+        elif type(node) is not type(other) or node._hash != other._hash:
+            return False
 
-    else:
-        raise ExpressionSyntaxError('right parens expected')
+        elif isinstance(node, Id):
+            if node.id != other.id:
+                return False
 
+        elif isinstance(node, Not):
+            stack.append((node.node, other.node))
 
+        elif isinstance(node, (And, Or)):
+            stack.append((node.right, other.right))
+            stack.append((node.left, other.left))
 
-def _parse_id(token:str):
-    if not _is_id(token):
-        raise ExpressionSyntaxError()
+    return True
 
-    else:
-        return Id(token)
 
+# maps each symbol to a weak reference to its Id node. The references to
+# dead nodes are dropped when the table grows over _sweep_size entries
+_interned = {}
+_sweep_size = 1024
 
-def _is_id(token:str) -> bool:
-    assert isinstance(token, str)
-    return token not in (LP, RP, TK_NOT, TK_AND, TK_OR)
 
+def _intern(key):
+    """
+    Builds and interns the Id node of the symbol `key`. Threads racing to
+    intern a symbol may each build a node for it, but these compare equal.
+    """
+    global _sweep_size
+
+    node = object.__new__(Id)
+    set_id, set_hash = Id._setters
+    set_id(node, key)
+    set_hash(node, hash(key))
+    _interned[key] = ref(node)
 
-class Node:
-    pass
+    if len(_interned) > _sweep_size:
+        for symbol, node_ref in list(_interned.items()):
+            if node_ref() is None and _interned.get(symbol) is node_ref:
+                _interned.pop(symbol, None)
+
+        _sweep_size = max(1024, 2 * len(_interned))
+
+    return node
 
 
-@dataclass
+@dataclass(frozen=True, eq=False, init=False)
 class Id(Node):
+    __slots__ = ('id',)
     id: str
 
+    def __new__(cls, id):
+        node_ref = _interned.get(id)
+
+        if node_ref is not None:
+            node = node_ref()
+
+            if node is not None:
+                return node
+
+        return _intern(id)
+
 
-@dataclass
+@dataclass(frozen=True, eq=False, init=False)
 class Not(Node):
+    __slots__ = ('node',)
     node: Node
 
+    def __init__(self, node):
+        set_node, set_hash = self._setters
+        set_node(self, node)
+        set_hash(self, hash((Not, node._hash)))
 
-@dataclass
+
+@dataclass(frozen=True, eq=False, init=False)
 class And(Node):
+    __slots__ = ('left', 'right')
     left: Node
     right: Node
 
+    def __init__(self, left, right):
+        set_left, set_right, set_hash = self._setters
+        set_left(self, left)
+        set_right(self, right)
+        set_hash(self, hash((And, left._hash, right._hash)))
+
 
-@dataclass
+@dataclass(frozen=True, eq=False, init=False)
 class Or(Node):
+    __slots__ = ('left', 'right')
     left: Node
     right: Node
 
+    def __init__(self, left, right):
+        set_left, set_right, set_hash = self._setters
+        set_left(self, left)
+        set_right(self, right)
+        set_hash(self, hash((Or, left._hash, right._hash)))
+
 
-@dataclass
+@dataclass(frozen=True, eq=False, init=False)
 class TrueNode(Node):
-    pass
+    __slots__ = ()
+
+    def __new__(cls):
+        return _TRUE
+
+
+@dataclass(frozen=True, eq=False, init=False)
+class FalseNode(Node):
+    __slots__ = ()
+
+    def __new__(cls):
+        return _FALSE
+
+
+def _constant(cls):
+    node = object.__new__(cls)
+    set_hash, = cls._setters
+    set_hash(node, hash(cls))
+    return node
+
+
+# the constants are single objects too
+_TRUE = _constant(TrueNode)
+_FALSE = _constant(FalseNode)
 
 
 def evaluate(node, symbols):
-    if isinstance(node, Id):
-        return node.id in symbols
+    """
+    Evaluates an expression tree for the given set of symbols. The tree is
+    walked with a stack, so deeply nested expressions do not hit the
+    recursion limit.
+    """
+    value = False
+    # the nodes to evaluate, the _NEGATE marks of the not nodes, and the
+    # (operator, right operand) pairs of the and/or nodes whose left operand
+    # is being evaluated
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if item is _NEGATE:
+            value = not value
+
+        elif type(item) is tuple:
+            operator, right = item
+
+            # "and" goes on when its left operand is true, "or" when false
+            if value is (operator is And):
+                stack.append(right)
+
+        elif isinstance(item, Id):
+            value = item.id in symbols
+
+        elif isinstance(item, Not):
+            stack.append(_NEGATE)
+            stack.append(item.node)
+
+        elif isinstance(item, (And, Or)):
+            stack.append((type(item), item.right))
+            stack.append(item.left)
+
+        elif isinstance(item, TrueNode):
+            value = True
+
+        elif isinstance(item, FalseNode):
+            value = False
+
+        else:
+            raise ValueError
+
+    return value
+
+
+_NEGATE = object()
+
+
+def to_source(node, symbols_name='symbols'):
+    """
+    Translates an expression tree to the source of an equivalent Python
+    expression, which tests the presence of each symbol in `symbols_name`.
+    """
+    parts = []
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, str):
+            parts.append(item)
+
+        elif isinstance(item, Id):
+            parts.append(repr(item.id) + ' in ' + symbols_name)
+
+        elif isinstance(item, Not):
+            if isinstance(item.node, (And, Or)):
+                stack.extend((')', item.node, 'not ('))
+
+            else:
+                stack.extend((item.node, 'not '))
+
+        elif isinstance(item, (And, Or)):
+            operator = ' and ' if isinstance(item, And) else ' or '
+            operands = _flatten(item)
+
+            for i, operand in enumerate(reversed(operands)):
+                if i:
+                    stack.append(operator)
+
+                if isinstance(operand, (And, Or)):
+                    stack.extend((')', operand, '('))
+
+                else:
+                    stack.append(operand)
+
+        elif isinstance(item, TrueNode):
+            parts.append('True')
+
+        elif isinstance(item, FalseNode):
+            parts.append('False')
+
+        else:
+            raise ValueError
+
+    return ''.join(parts)
+
+
+def _flatten(node):
+    """
+    Lists the operands of a chain of the same associative operator, so
+    `(a and b) and c` turns into `[a, b, c]`.
+    """
+    kind = type(node)
+    operands = []
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if type(item) is kind:
+            stack.append(item.right)
+            stack.append(item.left)
+
+        else:
+            operands.append(item)
+
+    return operands
+
+
+def simplify(node, known=None):
+    """
+    Returns a simpler expression equivalent to the given one: removes double
+    negations, repeated operands (a and a), absorbed operands (a or (a and b)),
+    and folds constants, so conditions known to be always true or false turn
+    into TrueNode or FalseNode.
+
+    `known` optionally maps symbols to their known boolean values, which are
+    replaced in the expression. Without it, expressions with nothing to
+    simplify are returned at once, and the simplified expression of the
+    others is computed once, and shared by all their occurrences.
+    """
+    if not known:
+        if _is_simple(node):
+            return node
+
+        cached = _simplified.get(node, _NOT_SIMPLIFIED)
+        if cached is not _NOT_SIMPLIFIED:
+            # None stands for the node itself, which the cache can not refer to
+            return node if cached is None else cached
+
+    simplified = {}
+    # the nodes to simplify, and (node, operands) pairs of the nodes whose
+    # operands are simplified already when popped
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if type(item) is tuple:
+            item, operands = item
+
+            if isinstance(item, Not):
+                simplified[item] = _simplify_not(simplified[item.node])
+
+            else:
+                chain = [simplified[operand] for operand in operands]
+                simplified[item] = _simplify_chain(type(item), chain, item if chain == operands else None)
+
+        elif item in simplified:
+            continue
 
-    elif isinstance(node, Not):
-        return not evaluate(node.node, symbols)
+        elif isinstance(item, Not):
+            stack.append((item, None))
+            stack.append(item.node)
 
-    elif isinstance(node, And):
-        return evaluate(node.left, symbols) and evaluate(node.right, symbols)
+        elif isinstance(item, (And, Or)):
+            operands = _flatten(item)
+            stack.append((item, operands))
+            stack.extend(operands)
 
-    elif isinstance(node, Or):
-        return evaluate(node.left, symbols) or evaluate(node.right, symbols)
+        elif known and isinstance(item, Id) and item.id in known:
+            simplified[item] = TrueNode() if known[item.id] else FalseNode()
 
-    elif isinstance(node, TrueNode):
-        return True
+        else:
+            simplified[item] = item
+
+    result = simplified[node]
+
+    if not known:
+        _simplified[node] = None if result is node else result
+
+    return result
+
+
+_simplified = WeakKeyDictionary()
+_NOT_SIMPLIFIED = object()
+
+
+def _is_simple(node):
+    """
+    Tells whether an expression has nothing to simplify: it has no constants,
+    no double negations, and no symbol appears twice in it, so none of its
+    operands can repeat, absorb or contradict another one.
+    """
+    symbols = set()
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, Id):
+            if item.id in symbols:
+                return False
+
+            symbols.add(item.id)
+
+        elif isinstance(item, Not):
+            if isinstance(item.node, Not):
+                return False
+
+            stack.append(item.node)
+
+        elif isinstance(item, (And, Or)):
+            stack.append(item.right)
+            stack.append(item.left)
+
+        else:
+            return False
+
+    return True
+
+
+def _simplify_not(operand):
+    if isinstance(operand, Not):
+        return operand.node
+
+    elif isinstance(operand, TrueNode):
+        return FalseNode()
+
+    elif isinstance(operand, FalseNode):
+        return TrueNode()
+
+    return Not(operand)
+
+
+def _simplify_chain(kind, operands, node=None):
+    """
+    Simplifies a chain of simplified operands of the same operator. `node`,
+    when given, is the chain of these operands, returned as it is when none
+    of them is dropped.
+    """
+    # for an "and" chain, a false operand decides it, and a true one is neutral
+    # (the other way round for "or")
+    absorbing, neutral = (FalseNode, TrueNode) if kind is And else (TrueNode, FalseNode)
+    other_kind = Or if kind is And else And
+
+    unique = {}
+    for operand in operands:
+        if type(operand) is kind:
+            unique.update(dict.fromkeys(_flatten(operand)))
+
+        else:
+            unique[operand] = None
+
+    result = []
+    for operand in unique:
+        if isinstance(operand, absorbing):
+            return absorbing()
+
+        elif isinstance(operand, Not) and operand.node in unique:
+            # a and not a, a or not a
+            return absorbing()
+
+        elif isinstance(operand, neutral):
+            continue
+
+        elif type(operand) is other_kind and any(item in unique for item in _flatten(operand)):
+            # absorbed: a and (a or b), a or (a and b)
+            continue
+
+        result.append(operand)
+
+    if not result:
+        return neutral()
+
+    if node is not None and len(result) == len(operands):
+        return node
+
+    if kind is And:
+        node = result[0]
+        for operand in result[1:]:
+            node = And(node, operand)
 
     else:
-        raise ValueError
+        node = result[-1]
+        for operand in reversed(result[:-1]):
+            node = Or(operand, node)
+
+    return node
+
+
+def truth_columns(symbols):
+    """
+    Returns the column of bits of each of the given symbols in their truth
+    tables (see truth_table): bit m of the column of the i-th symbol is set
+    when bit i of m is set.
+    """
+    size = 1 << len(symbols)
+    columns = {}
+
+    for i, symbol in enumerate(symbols):
+        # the assignments with bit i set: runs of 2^i ones, every 2^(i+1) bits
+        column = ((1 << (1 << i)) - 1) << (1 << i)
+        period = 2 << i
+
+        while period < size:
+            column |= column << period
+            period *= 2
+
+        columns[symbol] = column
+
+    return columns
+
+
+def truth_table(node, symbols, columns=None):
+    """
+    Evaluates an expression for every assignment of the given symbols at
+    once. Returns an integer whose bit m is set when the expression is true
+    for the assignment m, where the i-th symbol is true when bit i of m is
+    set. Each symbol is a column of bits, so every operator takes a single
+    operation over all the assignments.
+
+    `columns` optionally are the truth_columns of the symbols, computed once
+    for the tables of many expressions.
+    """
+    every = (1 << (1 << len(symbols))) - 1
+
+    if columns is None:
+        columns = truth_columns(symbols)
+
+    # the columns of the evaluated nodes, and the nodes to evaluate, each
+    # after the class of its parent, whose operation applies to the columns of
+    # the operands once evaluated
+    values = []
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if item is Not:
+            values.append(every ^ values.pop())
+
+        elif item is And:
+            right = values.pop()
+            values[-1] &= right
+
+        elif item is Or:
+            right = values.pop()
+            values[-1] |= right
+
+        elif isinstance(item, Id):
+            values.append(columns[item.id])
+
+        elif isinstance(item, TrueNode):
+            values.append(every)
+
+        elif isinstance(item, FalseNode):
+            values.append(0)
+
+        elif isinstance(item, Not):
+            stack.append(Not)
+            stack.append(item.node)
+
+        else:
+            stack.append(type(item))
+            stack.append(item.right)
+            stack.append(item.left)
+
+    return values[0]
+
+
+def compile_predicate(node):
+    """
+    Compiles an expression tree to a function that receives a set of symbols
+    and returns the boolean result of the expression.
+    Behaves like `evaluate`, but without walking the tree on every call.
+    Predicates are shared by all the occurrences of an expression.
+    """
+    predicate = _predicates.get(node)
+    if predicate is not None:
+        return predicate
+
+    try:
+        code = 'lambda symbols: ' + to_source(node)
+        predicate = eval(code, {'__builtins__': {}})
+
+    except (SyntaxError, RecursionError, MemoryError):
+        # too deeply nested for the Python compiler: the tree is walked
+        return lambda symbols: evaluate(node, symbols)
+
+    _predicates[node] = predicate
+    return predicate
+
+
+_predicates = WeakKeyDictionary()
+
+
+def symbols_of(node):
+    """
+    Lists the symbols referenced by an expression, without repetitions, in
+    the order they first appear.
+    """
+    found = {}
+    stack = [node]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, Id):
+            found.setdefault(item.id)
+
+        elif isinstance(item, Not):
+            stack.append(item.node)
+
+        elif isinstance(item, (And, Or)):
+            stack.append(item.right)
+            stack.append(item.left)
+
+    return list(found)
+
+
+def to_mask_source(node, bits, mask_name='mask'):
+    """
+    Translates an expression tree to the source of an equivalent Python
+    expression over an integer mask, where `bits` maps each symbol to its bit.
+    The ids of a same and/or chain are tested together, in a single bit test.
+    """
+    parts = []
+    stack = [node]
+
+    def _group_test(operands, kind):
+        # splits the plain and negated ids of a chain from the other operands
+        positive = 0
+        negative = 0
+        others = []
+
+        for operand in operands:
+            if isinstance(operand, Id):
+                positive |= bits[operand.id]
+
+            elif isinstance(operand, Not) and isinstance(operand.node, Id):
+                negative |= bits[operand.node.id]
+
+            else:
+                others.append(operand)
+
+        tests = []
+        if kind is And:
+            if positive:
+                tests.append('{0} & {1} == {1}'.format(mask_name, _literal(positive)))
+
+            if negative:
+                tests.append('not {} & {}'.format(mask_name, _literal(negative)))
+
+        else:
+            if positive:
+                tests.append('{} & {}'.format(mask_name, _literal(positive)))
+
+            if negative:
+                tests.append('{0} & {1} != {1}'.format(mask_name, _literal(negative)))
+
+        return tests, others
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, str):
+            parts.append(item)
+
+        elif isinstance(item, Id):
+            parts.append('{} & {}'.format(mask_name, _literal(bits[item.id])))
+
+        elif isinstance(item, Not):
+            if isinstance(item.node, Id):
+                parts.append('not {} & {}'.format(mask_name, _literal(bits[item.node.id])))
+
+            else:
+                stack.extend((')', item.node, 'not ('))
+
+        elif isinstance(item, (And, Or)):
+            operator = ' and ' if isinstance(item, And) else ' or '
+            tests, others = _group_test(_flatten(item), type(item))
+            operands = ['(' + test + ')' for test in tests] + others
+
+            for i, operand in enumerate(reversed(operands)):
+                if i:
+                    stack.append(operator)
+
+                if isinstance(operand, (And, Or)):
+                    stack.extend((')', operand, '('))
+
+                else:
+                    stack.append(operand)
+
+        elif isinstance(item, TrueNode):
+            parts.append('True')
+
+        elif isinstance(item, FalseNode):
+            parts.append('False')
+
+        else:
+            raise ValueError
+
+    return ''.join(parts)
+
+
+def _literal(mask):
+    # large masks are written in hex, as decimal conversion of big integers is
+    # slow and limited by sys.get_int_max_str_digits
+    return str(mask) if mask.bit_length() < 64 else hex(mask)
+
+
+def compile_mask_predicate(node, bits):
+    """
+    Compiles an expression tree to a function that receives an integer mask
+    of the symbols, where `bits` maps each symbol to its bit, and returns the
+    (truthy) result of the expression.
+    """
+    try:
+        code = 'lambda mask: ' + to_mask_source(node, bits)
+        return eval(code, {'__builtins__': {}})
+
+    except (SyntaxError, RecursionError, MemoryError):
+        # too deeply nested for the Python compiler
+        symbols_bits = [(symbol, bits[symbol]) for symbol in symbols_of(node)]
+        return lambda mask: evaluate(node, {s for s, bit in symbols_bits if mask & bit})
+
+
+def dump_predicate(predicate):
+    """
+    Serializes the code of a predicate made by compile_predicate, or returns
+    None when it can not be serialized. The code is specific to the running
+    Python version.
+    """
+    if predicate.__closure__ is not None:
+        return None
+
+    return marshal.dumps(predicate.__code__)
+
+
+def load_predicate(data, node):
+    """
+    Rebuilds a predicate serialized by dump_predicate, compiling the node
+    again when there is no serialized code.
+    """
+    if data is None:
+        return compile_predicate(node)
+
+    return FunctionType(marshal.loads(data), {'__builtins__': {}})
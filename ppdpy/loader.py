@@ -0,0 +1,201 @@
+"""
+Template loader: finds template files by name in a list of directories, and
+keeps the compiled templates in a LRU registry.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from ppdpy.exceptions import TemplateNotFoundError
+from ppdpy.template_compiler import Template, Compiler, compile_path, ENGINE_INTERPRETER
+
+
+@dataclass
+class _Entry:
+    template: Template
+    path: str
+    mtime_ns: int
+    size: int
+    checked_at: float
+
+
+@dataclass
+class _NameLock:
+    lock: threading.Lock
+    # the threads using the lock; it is dropped when none is left
+    users: int = 0
+
+
+class TemplateLoader:
+    """
+    Loads templates by name, compiling each file once.
+
+    `search_paths` is a directory, or a list of directories, where the
+    templates are looked for, in order. At most `max_templates` templates, and
+    templates from at most `max_bytes` bytes of source files, are kept; the
+    least recently used ones are evicted first.
+
+    When `auto_reload` is true, the modification time and size of a file are
+    checked again when its template is requested, at most once every
+    `check_interval` seconds, and the file is compiled again when they change.
+
+    The templates are compiled with the directive `prefix`, or with the
+    prefix of the module level functions when it is None. The other arguments
+    are passed to compile_path. Loaders can be used from many threads at once.
+    """
+    def __init__(self, search_paths, max_templates=None, max_bytes=None, auto_reload=True,
+                 check_interval=1.0, encoding='utf-8', engine=ENGINE_INTERPRETER,
+                 cache_size=None, lazy=False, cache_dir=None, optimize=True, prefix=None):
+        if isinstance(search_paths, (str, os.PathLike)):
+            search_paths = [search_paths]
+
+        self.search_paths = [os.path.abspath(path) for path in search_paths]
+        self.max_templates = max_templates
+        self.max_bytes = max_bytes
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.compile_options = {'encoding': encoding, 'engine': engine, 'cache_size': cache_size,
+                                'lazy': lazy, 'cache_dir': cache_dir, 'optimize': optimize}
+        self.compiler = None if prefix is None else Compiler(prefix, engine, cache_size, lazy, optimize)
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # one lock per template name being loaded, so each file is compiled
+        # only once
+        self._name_locks = {}
+
+    def get(self, name):
+        """
+        Returns the compiled template of the given name, which is a path
+        relative to the search paths.
+        """
+        with self._lock:
+            entry = self._fresh_entry(name)
+            if entry is not None:
+                return entry.template
+
+            name_lock = self._name_locks.get(name)
+            if name_lock is None:
+                name_lock = self._name_locks[name] = _NameLock(threading.Lock())
+
+            name_lock.users += 1
+
+        try:
+            with name_lock.lock:
+                with self._lock:
+                    # another thread may have loaded the template meanwhile
+                    entry = self._fresh_entry(name)
+                    if entry is not None:
+                        return entry.template
+
+                    entry = self._entries.get(name)
+
+                return self._load(name, entry)
+
+        finally:
+            with self._lock:
+                name_lock.users -= 1
+
+                if not name_lock.users:
+                    del self._name_locks[name]
+
+    def get_loaded(self, name):
+        """
+        Returns the compiled template of the given name when it is loaded and
+        does not need to be checked for changes, or None otherwise. Never
+        blocks on file access or compilation.
+        """
+        with self._lock:
+            entry = self._fresh_entry(name)
+            return entry.template if entry is not None else None
+
+    def _fresh_entry(self, name):
+        """
+        Returns the entry of a template, when it exists and does not need to
+        be checked for changes. Called with the lock held.
+        """
+        entry = self._entries.get(name)
+
+        if entry is not None:
+            self._entries.move_to_end(name)
+
+            if not self.auto_reload or time.monotonic() - entry.checked_at < self.check_interval:
+                return entry
+
+        return None
+
+    def _load(self, name, entry):
+        path = self.find(name)
+
+        try:
+            stat = os.stat(path)
+
+            if entry is not None and (entry.path, entry.mtime_ns, entry.size) == (path, stat.st_mtime_ns, stat.st_size):
+                entry.checked_at = time.monotonic()
+                return entry.template
+
+            if self.compiler is None:
+                template = compile_path(path, **self.compile_options)
+
+            else:
+                template = self.compiler.compile_path(path, self.compile_options['encoding'],
+                                                      self.compile_options['cache_dir'])
+
+        except FileNotFoundError:
+            # the file was removed after it was found
+            raise TemplateNotFoundError('template not found: ' + name) from None
+
+        new_entry = _Entry(template, path, stat.st_mtime_ns, stat.st_size, time.monotonic())
+
+        with self._lock:
+            self._remove(name)
+            self._entries[name] = new_entry
+            self._total_bytes += new_entry.size
+            self._evict()
+
+        return template
+
+    def find(self, name):
+        """
+        Returns the path of the template file of the given name. Names can
+        not refer to files outside the search paths.
+        """
+        for search_path in self.search_paths:
+            path = os.path.normpath(os.path.join(search_path, name))
+
+            if os.path.commonpath((search_path, path)) != search_path:
+                continue
+
+            if os.path.isfile(path):
+                return path
+
+        raise TemplateNotFoundError('template not found: ' + name)
+
+    def _remove(self, name):
+        entry = self._entries.pop(name, None)
+
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+                (self.max_templates is not None and len(self._entries) > self.max_templates)
+                or (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """
+        Removes all the templates from the loader.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,103 @@
+"""
+Parallel batch rendering in a pool of worker processes.
+"""
+import os
+import pickle
+from functools import partial
+from itertools import islice
+
+from ppdpy.bitmask import symbols_mask
+from ppdpy.template_compiler import Template, render_many, _as_symbols_set
+
+CHUNK_SIZE = 1000
+
+# the template of a worker process, and the (symbol, bit) pairs of the masks
+# it gets
+_template = None
+_symbols_bits = None
+
+
+def _init_worker(template_data, symbols_bits):
+    global _template, _symbols_bits
+    _template = pickle.loads(template_data)
+    _symbols_bits = symbols_bits
+
+
+def _symbols(mask):
+    return {symbol for symbol, bit in _symbols_bits if mask & bit}
+
+
+def _render_chunk(masks):
+    return render_many(_template, map(_symbols, masks))
+
+
+def _write_chunk(jobs, encoding):
+    symbols_sets = [_symbols(mask) for mask, _ in jobs]
+    lengths = []
+
+    # bytes templates are written as they are
+    mode, encoding = ('wb', None) if _template.binary else ('w', encoding)
+
+    for text, (_, path) in zip(render_many(_template, symbols_sets), jobs):
+        with open(path, mode, encoding=encoding) as f:
+            lengths.append(f.write(text))
+
+    return lengths
+
+
+def _mask(symbols_bits, symbols):
+    # the workers get the mask of the referenced symbols: the other symbols
+    # and the values of dicts do not change the rendered text
+    return symbols_mask(symbols_bits, _as_symbols_set(symbols))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def render_parallel(template, symbols_sets, workers=None, chunksize=CHUNK_SIZE, output_paths=None,
+                    encoding='utf-8'):
+    """
+    Renders a template for each of the given sets of symbols, in a pool of
+    `workers` processes (the number of CPUs by default). The template is sent
+    once to each worker, and the sets of symbols in chunks of `chunksize`, as
+    masks of the symbols the template references.
+
+    Returns the list of rendered texts, in the same order as the sets.
+
+    When `output_paths` (an iterable with a path for each set of symbols) is
+    given, each text is written by the workers to its file instead, and the
+    list of numbers of characters (bytes, for bytes templates) written is
+    returned.
+    """
+    # imported here, as multiprocessing is slow to import
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not isinstance(template, Template):
+        raise ValueError('template should be an instance of Template')
+
+    if chunksize <= 0:
+        raise ValueError('chunksize should be a positive number')
+
+    symbols_bits = template.symbols_bits
+    masks = map(partial(_mask, symbols_bits), symbols_sets)
+
+    if output_paths is None:
+        function = _render_chunk
+        jobs = _chunks(masks, chunksize)
+
+    else:
+        function = partial(_write_chunk, encoding=encoding)
+        jobs = _chunks(zip(masks, map(os.fspath, output_paths)), chunksize)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(pickle.dumps(template, pickle.HIGHEST_PROTOCOL), symbols_bits)) as executor:
+        results = executor.map(function, jobs)
+        return [result for chunk_results in results for result in chunk_results]
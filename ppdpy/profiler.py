@@ -0,0 +1,152 @@
+"""
+Render profiler: an instrumented renderer that counts, for each conditional
+entry, how many times its expression was evaluated and how many times it was
+selected, and measures the time spent evaluating expressions apart from the
+time spent emitting text.
+
+The instrumented renderer is built only for the templates being profiled, so
+the renders of other templates run exactly as before.
+"""
+from time import perf_counter
+
+from ppdpy.template_compiler import TextBlock, ConditionalBlock, LazyBlock, LINEBREAK
+
+# Indexes of the counters of an entry
+_EVALUATED = 0
+_SELECTED = 1
+_TIME = 2
+
+
+class Profile:
+    """
+    The counters recorded by the renders of a profiled template.
+    """
+    def __init__(self):
+        self.renders = 0
+        self.render_time = 0.0
+        # the counters of the entries, by line number
+        self._entries = {}
+
+    def _counters(self, line_number):
+        counters = self._entries.get(line_number)
+
+        if counters is None:
+            counters = self._entries[line_number] = [0, 0, 0.0]
+
+        return counters
+
+    @property
+    def evaluation_time(self):
+        """
+        The total time spent evaluating expressions, in seconds.
+        """
+        return sum(counters[_TIME] for counters in self._entries.values())
+
+    @property
+    def text_time(self):
+        """
+        The total time spent emitting text, in seconds: the time of the
+        renders not spent evaluating expressions.
+        """
+        return max(self.render_time - self.evaluation_time, 0.0)
+
+    def reset(self):
+        """
+        Sets every counter to zero.
+        """
+        self.renders = 0
+        self.render_time = 0.0
+
+        for counters in self._entries.values():
+            counters[:] = [0, 0, 0.0]
+
+    def report(self):
+        """
+        Returns the counters as a dict of plain values, where the entries are
+        keyed by the line number of their directive (#if, #elif or #else), in
+        order. Entries of conditionals built without line numbers are summed
+        under None.
+        """
+        entries = sorted(self._entries.items(), key=lambda item: (item[0] is None, item[0] or 0))
+
+        return {
+            'renders': self.renders,
+            'render_time': self.render_time,
+            'evaluation_time': self.evaluation_time,
+            'text_time': self.text_time,
+            'entries': {
+                line_number: {
+                    'evaluated': counters[_EVALUATED],
+                    'selected': counters[_SELECTED],
+                    'evaluation_time': counters[_TIME],
+                }
+                for line_number, counters in entries
+            },
+        }
+
+
+def _translate(blocks, profile):
+    """
+    Translates a block list to a list of strings and conditionals, where
+    each conditional is a list of (predicate, counters, translated blocks)
+    triples. Lazy blocks are parsed.
+    """
+    program = []
+
+    for block in blocks:
+        if isinstance(block, TextBlock):
+            if block.text:
+                program.append(block.text)
+
+        elif isinstance(block, ConditionalBlock):
+            entry_lines = block.entry_lines or [None] * len(block.if_entries)
+            program.append([(predicate, profile._counters(line_number), _translate(inner_blocks, profile))
+                            for (predicate, inner_blocks), line_number in zip(block.compiled_entries, entry_lines)])
+
+        elif isinstance(block, LazyBlock):
+            program.extend(_translate(block.blocks, profile))
+
+        else:
+            raise ValueError('unexpected block type')
+
+    return program
+
+
+def _run(program, symbols, append):
+    for item in program:
+        if item.__class__ is not list:
+            append(item)
+
+        else:
+            for predicate, counters, inner_program in item:
+                start = perf_counter()
+                selected = predicate(symbols)
+                counters[_TIME] += perf_counter() - start
+                counters[_EVALUATED] += 1
+
+                if selected:
+                    counters[_SELECTED] += 1
+                    _run(inner_program, symbols, append)
+                    break
+
+
+def build_renderer(blocks, profile, binary=False):
+    """
+    Returns a function that renders the given blocks (of a bytes template,
+    with `binary`) from a set of symbols, recording its counters into
+    `profile`.
+    """
+    empty = b'' if binary else ''
+    program = _translate(blocks, profile)
+
+    def render(symbols):
+        start = perf_counter()
+        parts = []
+        _run(program, symbols, parts.append)
+        text = empty.join(parts)[:-len(LINEBREAK)]
+
+        profile.render_time += perf_counter() - start
+        profile.renders += 1
+        return text
+
+    return render
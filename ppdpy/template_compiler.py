@@ -1,122 +1,750 @@
-from typing import List, Tuple
-from dataclasses import dataclass
+import mmap
+import os
+import re
+import string
+from typing import Callable, FrozenSet, List, Optional, Tuple
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+from itertools import chain
 from ppdpy.expression_compiler import compile as compile_expression, \
-    evaluate as evaluate_expression, \
+    compile_predicate, \
+    dump_predicate, \
+    load_predicate, \
+    simplify, \
+    symbols_of, \
+    truth_columns, \
+    truth_table, \
     Node as ExpressionNode, \
-    TrueNode
-from ppdpy.exceptions import PpdPyError, DirectiveSyntaxError
+    TrueNode, \
+    FalseNode
+from ppdpy.exceptions import DirectiveSyntaxError
 
 LINEBREAK = '\n'
 
+# Bytes templates: their directives are decoded with this encoding
+BYTES_ENCODING = 'utf-8'
+
+# Rendering engines
+ENGINE_INTERPRETER = 'interpreter'
+ENGINE_CODEGEN = 'codegen'
+ENGINE_BITMASK = 'bitmask'
+
+ENGINES = (ENGINE_INTERPRETER, ENGINE_CODEGEN, ENGINE_BITMASK)
+
+# Maximum number of entries of a materialized variants table
+MAX_VARIANTS = 1024
+
+# Maximum number of symbols of a conditional whose entries are compared by
+# truth tables when optimizing
+MAX_TRUTH_TABLE_SYMBOLS = 12
+
 # Preprocessor Directive Sufix
 PPD_PREFIX = '#'
 
-_PPD_IF = ''
-_PPD_ELIF = ''
-_PPD_ELSE = ''
-_PPD_ENDIF = ''
+
+class Compiler:
+    """
+    Compiles templates whose directives start with `prefix`, with the given
+    options (see compile_text and compile_path).
+
+    A compiler holds its own directive patterns and is never modified, so it
+    can be shared by threads, and compilers of different prefixes can compile
+    at the same time.
+    """
+    def __init__(self, prefix=PPD_PREFIX, engine=ENGINE_INTERPRETER, cache_size=None, lazy=False,
+                 optimize=True):
+        if not isinstance(prefix, str):
+            raise ValueError('prefix should be a string')
+
+        for c in prefix:
+            if c not in _PREFIX_CHARS:
+                raise ValueError('invalid prefix character ' + repr(c))
+
+        if engine not in ENGINES:
+            raise ValueError('unknown engine ' + repr(engine))
+
+        self.prefix = prefix
+        self.engine = engine
+        self.cache_size = cache_size
+        self.lazy = lazy
+        self.optimize = optimize
+
+        # the directives are compared in lowercase: (if, elif, else, endif)
+        self.directives = tuple((prefix + name).lower() for name in ('if', 'elif', 'else', 'endif'))
+        # matches the lines whose first visible chars are the prefix
+        self.directive_line = re.compile(r'^[^\S\n]*' + re.escape(prefix) + r'[^\n]*', re.MULTILINE)
+
+    def __repr__(self):
+        return 'Compiler(prefix={!r})'.format(self.prefix)
+
+    def compile(self, lines):
+        """
+        Compiles an iterable of lines (such as a text file).
+        """
+        return self._compile(lines, self.engine, self.cache_size, self.lazy, self.optimize)
+
+    def compile_text(self, text):
+        """
+        Compiles a string.
+        """
+        return self._compile_text(text, self.engine, self.cache_size, self.lazy, self.optimize)
+
+    def compile_path(self, path, encoding='utf-8', cache_dir=None):
+        """
+        Compiles a text file, read once as bytes when the encoding allows it.
+        """
+        return self._compile_path(path, encoding, self.engine, self.cache_size, self.lazy, cache_dir,
+                                  self.optimize)
+
+    def _compile(self, lines, engine, cache_size, lazy, optimize):
+        lines = iter(lines)
+        first = next(lines, '')
+
+        if isinstance(first, (bytes, bytearray)):
+            text = b'\n'.join(line.rstrip(b'\r\n') for line in chain((first, ), lines))
+
+        else:
+            text = LINEBREAK.join(line.rstrip('\r\n') for line in chain((first, ), lines))
+
+        return self._compile_text(text, engine, cache_size, lazy, optimize)
+
+    def _compile_text(self, text, engine, cache_size, lazy, optimize):
+        if isinstance(text, (bytes, bytearray, memoryview)):
+            return self._compile_bytes(bytes(text), engine, cache_size, lazy, optimize)
+
+        if '\r' in text:
+            # line breaks are normalized, as if each line was rstripped
+            text = _TRAILING_CR.sub('', text)
+
+        source = _TextSource(text, self.directive_line, self.directives)
+        return _compile_source(source, engine, cache_size, lazy, optimize)
+
+    def _compile_bytes(self, data, engine, cache_size, lazy, optimize):
+        pattern = _buffer_directive_line(self.prefix, BYTES_ENCODING)
+
+        if b'\r' in data:
+            data = _TRAILING_CR_BYTES.sub(b'', data)
+
+        source = _BytesSource(data, pattern, self.directives)
+        return _compile_source(source, engine, cache_size, lazy, optimize)
+
+    def _compile_path(self, path, encoding, engine, cache_size, lazy, cache_dir, optimize):
+        pattern = _buffer_directive_line(self.prefix, encoding)
+
+        if pattern is None:
+            if cache_dir is not None:
+                raise ValueError('cache_dir needs an encoding compatible with ASCII, not ' + repr(encoding))
+
+            with open(path, encoding=encoding) as file:
+                return self._compile(file, engine, cache_size, lazy, optimize)
+
+        with open(path, 'rb') as file:
+            if lazy or os.fstat(file.fileno()).st_size == 0:
+                # the lazy blocks parse their entries later, from a snapshot
+                # of the file, so later changes to the file do not reach them
+                return self._compile_buffer(file.read(), path, encoding, pattern, engine, cache_size, lazy,
+                                            cache_dir, optimize)
+
+            # the directives are found in the mapped file, and the text blocks
+            # are decoded from it, so the file is not copied as a whole. The
+            # mapping is closed once compiled
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                return self._compile_buffer(mapping, path, encoding, pattern, engine, cache_size, lazy,
+                                            cache_dir, optimize)
+
+    def _compile_buffer(self, buffer, path, encoding, pattern, engine, cache_size, lazy, cache_dir, optimize):
+        if buffer.find(b'\r') >= 0:
+            # line breaks are normalized as in text files: \r\n and \r are \n
+            buffer = bytes(buffer).replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+        length = len(buffer)
+        if buffer[length - 1:length] == b'\n':
+            # the line break of the last line is ignored, as in compile(file)
+            length -= 1
+
+        source = _BufferSource(buffer, length, encoding, pattern, self.directives)
+
+        if cache_dir is None:
+            return _compile_source(source, engine, cache_size, lazy, optimize)
+
+        from ppdpy import compiled_cache
+
+        cache_file = compiled_cache.cache_file(cache_dir, path, self.prefix, encoding, lazy, optimize)
+        key = compiled_cache.source_key(buffer, self.prefix, encoding, lazy, optimize)
+        blocks = compiled_cache.load(cache_file, key, buffer)
+
+        if blocks is None:
+            blocks = _parse_source(source, lazy, optimize)
+            compiled_cache.save(cache_file, key, blocks, buffer)
+
+        return Template(blocks, engine, cache_size)
+
+
+_PREFIX_CHARS = frozenset(string.digits + string.ascii_letters + string.punctuation)
+
+# The compiler of the module level functions
+_default_compiler = Compiler()
 
 
 def set_directive_prefixes(prefix):
-    global PPD_PREFIX, _PPD_IF, _PPD_ELIF, _PPD_ELSE, _PPD_ENDIF
+    """
+    Sets the directive prefix of the module level compile functions.
+    """
+    global PPD_PREFIX, _default_compiler
+    _default_compiler = Compiler(prefix)
     PPD_PREFIX = prefix
 
-    _PPD_IF = PPD_PREFIX + 'if'
-    _PPD_ELIF = PPD_PREFIX + 'elif'
-    _PPD_ELSE = PPD_PREFIX + 'else'
-    _PPD_ENDIF = PPD_PREFIX + 'endif'
 
+def compile(lines, engine=ENGINE_INTERPRETER, cache_size=None, lazy=False, optimize=True):
+    """
+    Compiles an iterable of lines (such as a text file). Lines of bytes (such
+    as the lines of a binary file) compile to a bytes template.
+    """
+    return _default_compiler._compile(lines, engine, cache_size, lazy, optimize)
 
-set_directive_prefixes(PPD_PREFIX)
 
+def compile_text(text, engine=ENGINE_INTERPRETER, cache_size=None, lazy=False, optimize=True):
+    """
+    Compiles a string. The text is scanned once, looking for directive lines,
+    and the text blocks are slices of the original string.
 
-def compile(lines):
-    iterlines = iter(lines)
+    With `optimize`, the compiled blocks are simplified by optimize_blocks.
 
-    result, remainder = _parse_until(iterlines, tuple())
+    A bytes-like text compiles to a bytes template: its directives are found
+    in the bytes, its text blocks are kept as bytes, and it renders bytes.
+    """
+    return _default_compiler._compile_text(text, engine, cache_size, lazy, optimize)
 
-    if remainder:
-        raise PpdPyError('parse ended unexpectedly')
 
-    return Template(result)
+def compile_path(path, encoding='utf-8', engine=ENGINE_INTERPRETER, cache_size=None, lazy=False,
+                 cache_dir=None, optimize=True):
+    """
+    Compiles a text file, like compile(open(path)), but the directives are
+    found directly in the bytes of the file, and each text block is decoded
+    from them once. The file is memory mapped while it is compiled; lazy
+    templates read it into bytes instead, and keep them to parse their
+    entries later. The template does not depend on the file after it is
+    compiled.
+
+    Only encodings compatible with ASCII (such as UTF-8 and Latin-1) are
+    compiled as bytes; other encodings are read and decoded as usual.
+
+    When `cache_dir` is given, the compiled template is stored in that
+    directory, and loaded from there while the file does not change. It
+    raises ValueError with encodings not compatible with ASCII.
+    """
+    return _default_compiler._compile_path(path, encoding, engine, cache_size, lazy, cache_dir, optimize)
+
+
+def _compile_source(source, engine, cache_size, lazy, optimize):
+    return Template(_parse_source(source, lazy, optimize), engine, cache_size, source.binary)
 
-def _parse_until(lines, end_directives):
-    result = []
-    current_block = TextBlock()
 
+def _parse_source(source, lazy, optimize):
+    if lazy:
+        return _parse_lazy(source, 0, source.length, optimize)
+
+    return _parse(source, optimize)
+
+
+_TRAILING_CR = re.compile(r'\r+(?=\n|\Z)')
+_TRAILING_CR_BYTES = re.compile(br'\r+(?=\n|\Z)')
+_LINEBREAK_BYTES = re.compile(b'\n')
+
+# The characters of str.isspace(), besides the line break
+_WHITESPACE = '\t\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004' \
+    '\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+
+
+@lru_cache(maxsize=None)
+def _buffer_directive_line(prefix, encoding):
+    """
+    Builds the pattern that matches directive lines in bytes of the given
+    encoding, or returns None when the encoding is not compatible with ASCII.
+    """
     try:
-        while True:
-            line = next(lines).rstrip('\r\n')
-            l = line.strip()
+        if LINEBREAK.encode(encoding) != b'\n' or prefix.encode(encoding) != prefix.encode('ascii'):
+            return None
+
+    except (UnicodeError, LookupError):
+        return None
+
+    single_bytes = []
+    multiple_bytes = []
+
+    for char in _WHITESPACE:
+        try:
+            encoded = char.encode(encoding)
+
+        except UnicodeError:
+            continue
+
+        if len(encoded) == 1:
+            single_bytes.append(re.escape(encoded))
+
+        else:
+            multiple_bytes.append(re.escape(encoded))
+
+    whitespace = b'|'.join([b'[' + b''.join(single_bytes) + b']'] + multiple_bytes)
+    return re.compile(b'^(?:' + whitespace + b')*' + re.escape(prefix.encode('ascii')) + b'[^\n]*',
+                      re.MULTILINE)
+
+
+class _TextSource:
+    """
+    A template source string, where `pattern` matches the directive lines,
+    and `directives` are the (if, elif, else, endif) directives. The parsers
+    create the blocks of a source through these methods.
+    """
+    # the text blocks are bytes
+    binary = False
+
+    def __init__(self, text, pattern, directives):
+        self.data = text
+        self.length = len(text)
+        self.pattern = pattern
+        self.directives = directives
+
+    def directive_line(self, match):
+        return match.group().strip()
+
+    def text_block(self, start, stop):
+        return TextBlock(self.data[start:stop])
+
+    def count_lines(self, start, stop):
+        return self.data.count(LINEBREAK, start, stop)
+
+    def last_text_block(self, pos):
+        """
+        The text block after the last directive line. The last line of the
+        text gets a line break, as every other line.
+        """
+        if pos > self.length:
+            # the text ends with a directive line
+            return TextBlock('')
+
+        return TextBlock(self.data[pos:self.length] + LINEBREAK)
+
+
+def _decode_directive(line, encoding):
+    try:
+        return line.decode(encoding).strip()
+
+    except UnicodeDecodeError:
+        raise DirectiveSyntaxError('invalid {} in directive'.format(encoding))
+
+
+class _BytesSource(_TextSource):
+    """
+    A template source of bytes, whose text blocks are slices of the bytes.
+    """
+    binary = True
+
+    def directive_line(self, match):
+        return _decode_directive(match.group(), BYTES_ENCODING)
+
+    def count_lines(self, start, stop):
+        return self.data.count(b'\n', start, stop)
+
+    def last_text_block(self, pos):
+        if pos > self.length:
+            return TextBlock(b'')
+
+        return TextBlock(self.data[pos:self.length] + b'\n')
+
+
+class _BufferSource(_BytesSource):
+    """
+    A template source of encoded bytes, such as the contents of a file or
+    its mapping. Only the first `length` bytes are compiled, and the text
+    blocks are decoded.
+    """
+    binary = False
+
+    def __init__(self, buffer, length, encoding, pattern, directives):
+        self.data = buffer
+        self.length = length
+        self.encoding = encoding
+        self.pattern = pattern
+        self.directives = directives
+
+    def directive_line(self, match):
+        return _decode_directive(match.group(), self.encoding)
+
+    def count_lines(self, start, stop):
+        if isinstance(self.data, bytes):
+            return self.data.count(b'\n', start, stop)
+
+        # mappings have no count()
+        return len(_LINEBREAK_BYTES.findall(self.data, start, stop))
+
+    def text_block(self, start, stop):
+        return TextBlock(str(memoryview(self.data)[start:stop], self.encoding))
+
+    def last_text_block(self, pos):
+        if pos > self.length:
+            return TextBlock('')
+
+        return TextBlock(str(memoryview(self.data)[pos:self.length], self.encoding) + LINEBREAK)
+
+
+def _parse(source, optimize=False):
+    """
+    Parses the whole source, keeping a stack of the open conditionals.
+
+    With `optimize`, each conditional is optimized when its end directive is
+    parsed, as optimize_blocks would do, and the text of each level merged.
+    """
+    directive_if, directive_elif, directive_else, directive_endif = source.directives
+    result = blocks = []
+    # open conditionals: (enclosing blocks, entries, entries lines, else found)
+    open_conditionals = []
+    pos = 0
+    # the line number of the `counted` offset
+    line_number = 1
+    counted = 0
+
+    for match in source.pattern.finditer(source.data, 0, source.length):
+        line = source.directive_line(match)
+        directive = _fetch_directive(line)
+        line_number += source.count_lines(counted, match.start())
+        counted = match.start()
+
+        if directive == directive_if:
+            if match.start() > pos:
+                blocks.append(source.text_block(pos, match.start()))
+
+            entries = []
+            open_conditionals.append((blocks, entries, [line_number], False))
+            blocks = []
+            entries.append((_parse_directive_expression(line), blocks))
+
+        elif open_conditionals and directive in (directive_elif, directive_else, directive_endif):
+            enclosing_blocks, entries, entry_lines, else_found = open_conditionals[-1]
 
-            if l.startswith(PPD_PREFIX):
-                directive = _fetch_directive(l)
+            if else_found and directive != directive_endif:
+                raise DirectiveSyntaxError('unexpected directive ' + directive)
 
-                if directive in end_directives:
-                    result.append(current_block)
-                    return result, l
+            blocks.append(source.text_block(pos, match.start()))
 
-                elif directive == _PPD_IF:
-                    if current_block.text:
-                        result.append(current_block)
-                        current_block = TextBlock()
+            if directive == directive_endif:
+                open_conditionals.pop()
+                blocks = enclosing_blocks
 
-                    if_entries = list(_parse_if_entries(l, lines))
-                    result.append(ConditionalBlock(if_entries))
+                if optimize:
+                    blocks.extend(_optimize_conditional(
+                        [(simplify(expression), _merge_text(entry_blocks)) for expression, entry_blocks in entries],
+                        entry_lines))
 
                 else:
-                    raise DirectiveSyntaxError('unexpected directive ' + directive)
+                    blocks.append(ConditionalBlock(entries, entry_lines))
 
-            else:
-                current_block.text += line + LINEBREAK
+            elif directive == directive_else:
+                open_conditionals[-1] = (enclosing_blocks, entries, entry_lines, True)
+                blocks = []
+                entries.append((TrueNode(), blocks))
+                entry_lines.append(line_number)
 
-    except StopIteration:
-        if end_directives:
-            raise DirectiveSyntaxError('missing end directive')
+            else:
+                blocks = []
+                entries.append((_parse_directive_expression(line), blocks))
+                entry_lines.append(line_number)
 
         else:
-            result.append(current_block)
-            return result, None
+            raise DirectiveSyntaxError('unexpected directive ' + directive)
 
+        pos = match.end() + len(LINEBREAK)
 
-def _parse_if_entries(last_line, lines):
-    while True:
-        try:
-            expression_string = last_line.split(' ', maxsplit=1)[1]
+    if open_conditionals:
+        raise DirectiveSyntaxError('missing end directive')
 
-        except IndexError:
-            raise DirectiveSyntaxError()
+    result.append(source.last_text_block(pos))
+    return _merge_text(result) if optimize else result
 
-        if_expression = compile_expression(expression_string)
-        if_blocks, last_line = _parse_until(lines, (_PPD_ELIF, _PPD_ELSE, _PPD_ENDIF))
-        yield (if_expression, if_blocks)
 
-        next_directive = _fetch_directive(last_line)
-        if next_directive == _PPD_ENDIF:
-            return
+def _parse_directive_expression(line):
+    try:
+        expression_string = line.split(' ', maxsplit=1)[1]
+
+    except IndexError:
+        raise DirectiveSyntaxError()
 
-        elif next_directive == _PPD_ELSE:
-            else_blocks, last_line = _parse_until(lines, (_PPD_ENDIF, ))
-            yield (TrueNode(), else_blocks)
-            return
+    return compile_expression(expression_string)
+
+
+def _parse_lazy(source, start, stop, optimize=False, line_number=1):
+    """
+    Parses the source in [start, stop) of a single nesting level, where
+    `start` is at line `line_number`. The contents of each conditional entry
+    are kept as a LazyBlock, which is parsed only when first rendered. Nested
+    conditionals are only checked for their structure.
+
+    With `optimize`, each level is simplified by optimize_blocks when parsed.
+    """
+    directive_if, directive_elif, directive_else, directive_endif = source.directives
+    result = []
+    pos = start
+    # the open conditional of this level: its entries and current entry
+    entries = None
+    entry_lines = None
+    expression = None
+    end_directives = None
+    # the nested conditionals: whether each one had its else entry
+    nested_else = []
+    counted = start
 
-        elif next_directive != _PPD_ELIF:
-            raise DirectiveSyntaxError()
+    for match in source.pattern.finditer(source.data, start, stop):
+        line = source.directive_line(match)
+        directive = _fetch_directive(line)
+
+        line_number += source.count_lines(counted, match.start())
+        counted = match.start()
+
+        if directive == directive_if:
+            if entries is None:
+                if match.start() > pos:
+                    result.append(source.text_block(pos, match.start()))
+
+                entries = []
+                entry_lines = [line_number]
+                expression = _parse_directive_expression(line)
+                end_directives = (directive_elif, directive_else, directive_endif)
+                pos = match.end() + len(LINEBREAK)
+
+            else:
+                nested_else.append(False)
+
+        elif nested_else and directive in (directive_elif, directive_else, directive_endif):
+            if directive == directive_endif:
+                nested_else.pop()
+
+            elif nested_else[-1]:
+                raise DirectiveSyntaxError('unexpected directive ' + directive)
+
+            elif directive == directive_else:
+                nested_else[-1] = True
+
+        elif entries is not None and directive in end_directives:
+            entries.append((expression, [LazyBlock(source, pos, match.start(), optimize, entry_lines[-1] + 1)]))
+            pos = match.end() + len(LINEBREAK)
+
+            if directive == directive_endif:
+                result.append(ConditionalBlock(entries, entry_lines))
+                entries = None
+
+            elif directive == directive_else:
+                expression = TrueNode()
+                end_directives = (directive_endif, )
+                entry_lines.append(line_number)
+
+            else:
+                expression = _parse_directive_expression(line)
+                entry_lines.append(line_number)
+
+        else:
+            raise DirectiveSyntaxError('unexpected directive ' + directive)
+
+    if entries is not None:
+        raise DirectiveSyntaxError('missing end directive')
+
+    if stop == source.length:
+        result.append(source.last_text_block(pos))
+
+    else:
+        result.append(source.text_block(pos, stop))
+
+    return optimize_blocks(result) if optimize else result
 
 
 def _fetch_directive(line):
-    ls = line.strip().lower()
-    try:
-        return ls.split(' ')[0]
+    return line.strip().lower().split(' ')[0]
 
-    except IndexError:
-        if ls == _PPD_ELSE:
-            return _PPD_ELSE
 
-        elif ls == _PPD_ENDIF:
-            return _PPD_ENDIF
+def optimize_blocks(blocks, known=None):
+    """
+    Returns a block list that renders the same text as the given one, but
+    faster: the expressions are simplified, the conditional entries that can
+    never be selected are dropped, the conditionals that always select the
+    same entry are replaced by its blocks, and adjacent text blocks are
+    merged. The given blocks are not modified, and lazy blocks are kept as
+    they are.
 
-        raise DirectiveSyntaxError()
+    `known` optionally maps symbols to their known boolean values, which are
+    replaced in the expressions. Lazy blocks are then parsed, so the whole
+    tree is specialized.
+    """
+    result = []
+    # frames of the blocks lists being optimized: (iterator of the blocks,
+    # optimized blocks), and of the conditionals: (iterator of the entries,
+    # optimized entries, optimized blocks of the enclosing list, entries lines)
+    stack = [(iter(blocks), result)]
+
+    while stack:
+        frame = stack[-1]
+
+        if len(frame) == 2:
+            blocks_iter, optimized = frame
+            block = next(blocks_iter, None)
+
+            if block is None:
+                stack.pop()
+                optimized[:] = _merge_text(optimized)
+
+            elif isinstance(block, ConditionalBlock):
+                stack.append((iter(block.if_entries), [], optimized, block.entry_lines))
+
+            elif known and isinstance(block, LazyBlock):
+                stack.append((iter(block.blocks), optimized))
+
+            else:
+                optimized.append(block)
+
+        else:
+            entries_iter, entries, optimized, entry_lines = frame
+            entry = next(entries_iter, None)
+
+            if entry is None:
+                stack.pop()
+                optimized.extend(_optimize_conditional(entries, entry_lines))
+
+            else:
+                expression, inner_blocks = entry
+                entries.append((simplify(expression, known), []))
+                stack.append((iter(inner_blocks), entries[-1][1]))
+
+    return result
+
+
+def specialize(template, known_true=(), known_false=()):
+    """
+    Returns a new template for the given template, where the `known_true`
+    symbols are always true and the `known_false` symbols are always false.
+    The conditions decided by them are folded at once, so renders only
+    evaluate the remaining ones.
+    """
+    if not isinstance(template, Template):
+        raise ValueError('template should be an instance of Template')
+
+    known_true = _as_symbols_set(known_true)
+    known_false = _as_symbols_set(known_false)
+
+    conflicting = [symbol for symbol in known_true if symbol in known_false]
+    if conflicting:
+        raise ValueError('symbols known both true and false: ' + ', '.join(sorted(conflicting)))
+
+    known = dict.fromkeys(known_false, False)
+    known.update(dict.fromkeys(known_true, True))
+
+    return Template(optimize_blocks(template.blocks, known), template.engine, template.cache_size, template.binary)
+
+
+def _merge_text(blocks):
+    """
+    Merges the adjacent plain text blocks of a list, and drops the empty
+    ones.
+    """
+    if len(blocks) == 1:
+        # a single block: nothing to merge
+        block = blocks[0]
+        return [] if type(block) is TextBlock and not block.text else blocks
+
+    merged = []
+    texts = []
+
+    for block in blocks + [None]:
+        if type(block) is TextBlock:
+            if block.text:
+                texts.append(block)
+
+            continue
+
+        if len(texts) == 1:
+            merged.append(texts[0])
+
+        elif texts:
+            # joined by an empty text of their type, str or bytes
+            merged.append(TextBlock(texts[0].text[:0].join(text.text for text in texts),
+                                    sum(text.lines for text in texts)))
+
+        texts = []
+
+        if block is not None:
+            merged.append(block)
+
+    return merged
+
+
+def _optimize_conditional(entries, entry_lines=None):
+    """
+    Optimizes the entries of a conditional, whose expressions are simplified
+    and blocks optimized already. Returns the blocks that replace it.
+    """
+    if len(entries) == 1:
+        # nothing to compare: only constant or empty entries change
+        expression, blocks = entries[0]
+
+        if isinstance(expression, FalseNode) or not blocks:
+            return []
+
+        elif isinstance(expression, TrueNode):
+            return blocks
+
+        return [ConditionalBlock(entries, entry_lines)]
+
+    symbols = {}
+    shared = False
+    for expression, _ in entries:
+        entry_symbols = symbols_of(expression)
+        shared = shared or any(symbol in symbols for symbol in entry_symbols)
+        symbols.update(dict.fromkeys(entry_symbols))
+
+    # an entry can only be covered by the entries before it when they test
+    # some of its symbols. Then, with few symbols, the assignments selecting
+    # each entry are computed
+    symbols = list(symbols)
+    use_tables = shared and len(symbols) <= MAX_TRUTH_TABLE_SYMBOLS
+    every = (1 << (1 << len(symbols))) - 1 if use_tables else None
+    columns = truth_columns(symbols) if use_tables else None
+    covered = 0
+    seen = set()
+    kept = []
+    kept_lines = []
+
+    for i, (expression, blocks) in enumerate(entries):
+        if isinstance(expression, FalseNode) or expression in seen:
+            continue
+
+        if use_tables:
+            selected = truth_table(expression, symbols, columns) & ~covered
+
+            if not selected:
+                continue
+
+            elif selected == every & ~covered:
+                # selected by every assignment that reaches it
+                expression = TrueNode()
+
+            covered |= selected
+
+        seen.add(expression)
+        kept.append((expression, blocks))
+        kept_lines.append(entry_lines[i] if entry_lines else None)
+
+        if isinstance(expression, TrueNode):
+            break
+
+    # trailing entries that render nothing are the same as no entry selected
+    while kept and not kept[-1][1]:
+        kept.pop()
+        kept_lines.pop()
+
+    if not kept:
+        return []
+
+    elif isinstance(kept[0][0], TrueNode):
+        return kept[0][1]
+
+    return [ConditionalBlock(kept, kept_lines if entry_lines else None)]
 
 
 def render(template, symbols):
@@ -126,31 +754,214 @@ def render(template, symbols):
     if not isinstance(template, Template):
         raise ValueError('template should be an instance of Template')
 
-    if isinstance(symbols, dict):
-        symbols = set(symbols.keys())
+    return template.renderer(_as_symbols_set(symbols))
+
+
+def render_iter(template, symbols):
+    """
+    Renders a template using the given symbols, yielding the text of each
+    selected block in order, without building the whole output.
+    """
+    if not isinstance(template, Template):
+        raise ValueError('template should be an instance of Template')
+
+    previous = None
+
+    for text in _iter_text(template.blocks, _as_symbols_set(symbols)):
+        if text:
+            if previous is not None:
+                yield previous
+
+            previous = text
+
+    if previous is not None:
+        # drops the line break of the last line, like render does
+        last = previous[:-len(LINEBREAK)]
+
+        if last:
+            yield last
+
+
+def render_into(template, out, symbols):
+    """
+    Renders a template using the given symbols into `out`: any object with a
+    `write` method (such as a file or io.StringIO), or a bytearray for bytes
+    templates, which gets the rendered bytes at its end. Returns the number
+    of characters (bytes, for bytes templates) written.
+
+    The text of each selected block is written once, as it is, and the
+    whole output is never built.
+    """
+    if not isinstance(template, Template):
+        raise ValueError('template should be an instance of Template')
+
+    if isinstance(out, bytearray):
+        if not template.binary:
+            raise ValueError('only bytes templates can be rendered into a bytearray')
+
+        write = out.extend
 
     else:
-        symbols = set(symbols)
+        write = out.write
+
+    written = 0
+    previous = None
+
+    for text in _iter_text(template.blocks, _as_symbols_set(symbols)):
+        if text:
+            if previous is not None:
+                write(previous)
+                written += len(previous)
+
+            previous = text
+
+    if previous is not None:
+        # drops the line break of the last line, like render does. Only this
+        # last text is copied, so writers always get str or bytes
+        last = previous[:-len(LINEBREAK)]
+
+        if last:
+            write(last)
+            written += len(last)
+
+    return written
+
+
+def render_many(template, symbols_sets):
+    """
+    Renders a template once for each of the given sets of symbols, and
+    returns the list of rendered texts, in the same order.
+    """
+    return list(iter_render_many(template, symbols_sets))
+
+
+def iter_render_many(template, symbols_sets):
+    """
+    Renders a template once for each of the given sets of symbols, yielding
+    the rendered texts in the same order.
+
+    The sets are grouped by their projection on the referenced symbols: each
+    distinct projection is rendered only once, and the sets of a same group
+    get the same string object.
+    """
+    if not isinstance(template, Template):
+        raise ValueError('template should be an instance of Template')
+
+    from ppdpy.bitmask import symbols_mask
+
+    symbols_bits = template.symbols_bits
+    renderer = template.renderer
+    rendered = {}
+
+    for symbols in symbols_sets:
+        symbols = _as_symbols_set(symbols)
+        mask = symbols_mask(symbols_bits, symbols)
+
+        text = rendered.get(mask)
+        if text is None:
+            text = rendered[mask] = renderer(symbols)
+
+        yield text
+
+
+def _iter_text(blocks, symbols):
+    """
+    Yields the text of the blocks selected by the given symbols.
+    """
+    stack = [iter(blocks)]
+
+    while stack:
+        block = next(stack[-1], None)
+
+        if block is None:
+            stack.pop()
+
+        elif isinstance(block, TextBlock):
+            yield block.text
+
+        elif isinstance(block, ConditionalBlock):
+            for predicate, inner_blocks in block.compiled_entries:
+                if predicate(symbols):
+                    stack.append(iter(inner_blocks))
+                    break
+
+        elif isinstance(block, LazyBlock):
+            stack.append(iter(block.blocks))
+
+        else:
+            raise ValueError('unexpected block type')
+
+
+def _as_symbols_set(symbols):
+    """
+    Returns the given symbols as a container with fast membership tests.
+    Sets and dicts are used as they are, without copying.
+    """
+    if isinstance(symbols, (set, frozenset)):
+        return symbols
+
+    elif isinstance(symbols, dict):
+        return symbols.keys()
+
+    else:
+        return set(symbols)
+
+
+def referenced_symbols(blocks):
+    """
+    Lists the symbols referenced by the expressions of a block list, without
+    repetitions, in the order they first appear.
+    """
+    found = {}
+    stack = list(reversed(blocks))
+
+    while stack:
+        block = stack.pop()
+
+        if isinstance(block, ConditionalBlock):
+            for expression, inner_blocks in reversed(block.if_entries):
+                stack.extend(reversed(inner_blocks))
+                stack.append(expression)
+
+        elif isinstance(block, LazyBlock):
+            stack.extend(reversed(block.blocks))
+
+        elif isinstance(block, ExpressionNode):
+            for symbol in symbols_of(block):
+                found.setdefault(symbol)
+
+    return list(found)
+
+
+def _interpret(blocks, symbols, binary=False):
+    """
+    Renders a list of blocks by walking the block tree. The blocks of bytes
+    templates are rendered with `binary`.
+    """
+    empty = b'' if binary else ''
 
     def _render_block(block):
         if isinstance(block, TextBlock):
             return block.text
 
         elif isinstance(block, ConditionalBlock):
-            for expression, inner_blocks in block.if_entries:
-                if evaluate_expression(expression, symbols):
+            for predicate, inner_blocks in block.compiled_entries:
+                if predicate(symbols):
                     return _render_block_list(inner_blocks)
 
             # none of the blocks applied
-            return ''
+            return empty
+
+        elif isinstance(block, LazyBlock):
+            return _render_block_list(block.blocks)
 
         else:
             raise ValueError('unexpected block type')
 
     def _render_block_list(blocks):
-        return ''.join((_render_block(block) for block in blocks))
+        return empty.join((_render_block(block) for block in blocks))
 
-    return _render_block_list(template.blocks)[:-len(LINEBREAK)]
+    return _render_block_list(blocks)[:-len(LINEBREAK)]
 
 
 class TemplateBlock:
@@ -160,9 +971,209 @@ class TemplateBlock:
 @dataclass
 class Template:
     """
-    A compiled text
+    A compiled text. Bytes templates (`binary`) have text blocks of bytes,
+    and render bytes.
     """
     blocks: List[TemplateBlock]
+    engine: str = ENGINE_INTERPRETER
+    cache_size: Optional[int] = None
+    binary: bool = False
+    _renderer: Callable = field(default=None, init=False, repr=False, compare=False)
+    _cached_render: Callable = field(default=None, init=False, repr=False, compare=False)
+    _referenced_symbols: FrozenSet[str] = field(default=None, init=False, repr=False, compare=False)
+    _variants: List[str] = field(default=None, init=False, repr=False, compare=False)
+    _symbols_bits: Tuple[Tuple[str, int], ...] = field(default=None, init=False, repr=False, compare=False)
+    _profile: object = field(default=None, init=False, repr=False, compare=False)
+    _unprofiled_renderer: Callable = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.engine not in ENGINES:
+            raise ValueError('unknown engine ' + repr(self.engine))
+
+        if self.cache_size is not None and self.cache_size <= 0:
+            raise ValueError('cache_size should be a positive number')
+
+    def __getstate__(self):
+        # renderers and caches are built again after unpickling
+        return {'blocks': self.blocks, 'engine': self.engine, 'cache_size': self.cache_size,
+                'binary': self.binary}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def referenced_symbols(self):
+        """
+        The set of symbols referenced by the expressions of this template.
+        Only these symbols can change the rendered text.
+        """
+        if self._referenced_symbols is None:
+            self._referenced_symbols = frozenset(referenced_symbols(self.blocks))
+
+        return self._referenced_symbols
+
+    @property
+    def symbols_bits(self):
+        """
+        The (symbol, bit) pairs of the referenced symbols, used to build the
+        symbols masks of the bitmask engine.
+        """
+        if self._symbols_bits is None:
+            from ppdpy.bitmask import assign_bits
+            self._symbols_bits = tuple(assign_bits(self.blocks).items())
+
+        return self._symbols_bits
+
+    @property
+    def renderer(self):
+        """
+        The function that renders this template from a set of symbols,
+        built by the template's engine on first use.
+        """
+        if self._renderer is None:
+            renderer = self._build_renderer()
+
+            if self.cache_size is not None:
+                renderer = self._build_cached_renderer(renderer)
+
+            self._renderer = renderer
+
+        return self._renderer
+
+    def _build_cached_renderer(self, renderer):
+        """
+        Memoizes the renderer in a LRU cache, keyed by the caller's symbols
+        intersected with the referenced symbols.
+        """
+        symbols = tuple(self.referenced_symbols)
+        cached_render = lru_cache(maxsize=self.cache_size)(renderer)
+        self._cached_render = cached_render
+
+        return lambda given: cached_render(frozenset([s for s in symbols if s in given]))
+
+    def cache_info(self):
+        """
+        Returns the hits, misses, maxsize and currsize of the render cache, or
+        None when the template has no cache (or is materialized, as the table
+        replaces the cache).
+        """
+        if self.cache_size is None or self._variants is not None:
+            return None
+
+        self.renderer  # makes sure the cache is built
+        return self._cached_render.cache_info()
+
+    def cache_clear(self):
+        """
+        Clears the render cache.
+        """
+        if self._cached_render is not None:
+            self._cached_render.cache_clear()
+
+    @property
+    def materialized(self):
+        """
+        True when the template renders from a table of precomputed outputs.
+        """
+        return self._variants is not None
+
+    def materialize(self, max_variants=MAX_VARIANTS):
+        """
+        Precomputes the outputs of every truth assignment of the referenced
+        symbols, so rendering becomes a single table lookup. Identical outputs
+        share the same string.
+
+        Does nothing and returns False when the table would need more than
+        `max_variants` entries; the template then keeps rendering normally.
+        Returns True otherwise. The render cache, if any, is dropped, as every
+        output is in the table.
+        """
+        from ppdpy.bitmask import symbols_mask
+
+        if self._variants is not None:
+            return True
+
+        symbols_bits = self.symbols_bits
+        if 1 << len(symbols_bits) > max_variants:
+            return False
+
+        renderer = self._build_renderer()
+        distinct = {}
+        variants = []
+
+        for mask in range(1 << len(symbols_bits)):
+            text = renderer({symbol for symbol, bit in symbols_bits if mask & bit})
+            variants.append(distinct.setdefault(text, text))
+
+        self._variants = variants
+        self._cached_render = None
+        renderer = lambda symbols: variants[symbols_mask(symbols_bits, symbols)]
+
+        if self._profile is None:
+            self._renderer = renderer
+
+        else:
+            # used once the profiling stops
+            self._unprofiled_renderer = renderer
+
+        return True
+
+    @property
+    def profile(self):
+        """
+        The ppdpy.profiler.Profile recorded by the renders, or None when the
+        template is not being profiled.
+        """
+        return self._profile
+
+    def start_profiling(self):
+        """
+        Renders with an instrumented renderer, which counts the evaluations
+        and selections of each conditional entry and times the renders, until
+        stop_profiling is called. Returns the ppdpy.profiler.Profile where the
+        counters are recorded.
+
+        The instrumented renderer replaces the template's renderer (and its
+        cache), so templates that are not profiled render as fast as before.
+        """
+        if self._profile is None:
+            from ppdpy.profiler import Profile, build_renderer
+
+            profile = Profile()
+            # built now, so the render cache exists while profiling
+            self._unprofiled_renderer = self.renderer
+            self._renderer = build_renderer(self.blocks, profile, self.binary)
+            self._profile = profile
+
+        return self._profile
+
+    def stop_profiling(self):
+        """
+        Restores the template's renderer, and returns the recorded profile
+        (None when the template was not being profiled).
+        """
+        profile = self._profile
+
+        if profile is not None:
+            self._renderer = self._unprofiled_renderer
+            self._unprofiled_renderer = None
+            self._profile = None
+
+        return profile
+
+    def _build_renderer(self):
+        if self.engine == ENGINE_CODEGEN:
+            from ppdpy.codegen import build_renderer
+            return build_renderer(self.blocks, self.binary)
+
+        elif self.engine == ENGINE_BITMASK:
+            from ppdpy.bitmask import build_renderer
+            return build_renderer(self.blocks, self.binary)
+
+        else:
+            blocks = self.blocks
+            binary = self.binary
+            return lambda symbols: _interpret(blocks, symbols, binary)
 
     def render(self, symbols):
         """
@@ -170,6 +1181,57 @@ class Template:
         """
         return render(self, symbols)
 
+    def render_iter(self, symbols):
+        """
+        Shorthand for render_iter(template, symbols)
+        """
+        return render_iter(self, symbols)
+
+    def render_into(self, out, symbols):
+        """
+        Shorthand for render_into(template, out, symbols)
+        """
+        return render_into(self, out, symbols)
+
+    def arender_iter(self, symbols):
+        """
+        Shorthand for ppdpy.aio.arender_iter(template, symbols)
+        """
+        from ppdpy.aio import arender_iter
+        return arender_iter(self, symbols)
+
+    def render_to_stream(self, writer, symbols, encoding='utf-8'):
+        """
+        Shorthand for ppdpy.aio.render_to_stream(template, writer, symbols)
+        """
+        from ppdpy.aio import render_to_stream
+        return render_to_stream(self, writer, symbols, encoding)
+
+    def specialize(self, known_true=(), known_false=()):
+        """
+        Shorthand for specialize(template, known_true, known_false)
+        """
+        return specialize(self, known_true, known_false)
+
+    def variants(self):
+        """
+        Shorthand for ppdpy.variants.variants(template)
+        """
+        from ppdpy.variants import variants
+        return variants(self)
+
+    def render_many(self, symbols_sets):
+        """
+        Shorthand for render_many(template, symbols_sets)
+        """
+        return render_many(self, symbols_sets)
+
+    def iter_render_many(self, symbols_sets):
+        """
+        Shorthand for iter_render_many(template, symbols_sets)
+        """
+        return iter_render_many(self, symbols_sets)
+
 
 @dataclass
 class TextBlock(TemplateBlock):
@@ -196,3 +1258,52 @@ class ConditionalBlock(TemplateBlock):
         #endif
     """
     if_entries: List[ConditionalEntry]
+    # the line number of the directive of each entry, when known
+    entry_lines: Optional[List[int]] = field(default=None, compare=False)
+
+    @cached_property
+    def compiled_entries(self):
+        """
+        The entries with their expressions compiled to predicates, on first
+        use.
+        """
+        return [(compile_predicate(expression), blocks) for expression, blocks in self.if_entries]
+
+    def __getstate__(self):
+        state = {'if_entries': self.if_entries, 'entry_lines': self.entry_lines}
+
+        compiled_entries = self.__dict__.get('compiled_entries')
+        if compiled_entries is not None:
+            state['predicates'] = [dump_predicate(predicate) for predicate, _ in compiled_entries]
+
+        return state
+
+    def __setstate__(self, state):
+        self.if_entries = state['if_entries']
+        self.entry_lines = state.get('entry_lines')
+
+        predicates = state.get('predicates')
+        if predicates is not None:
+            self.compiled_entries = [(load_predicate(predicate, expression), blocks)
+                                     for predicate, (expression, blocks) in zip(predicates, self.if_entries)]
+
+
+@dataclass
+class LazyBlock(TemplateBlock):
+    """
+    The contents of a conditional entry of a lazily compiled template: the
+    span [start, stop) of the source, parsed to blocks on first use.
+    """
+    source: _TextSource = field(repr=False, compare=False)
+    start: int
+    stop: int
+    optimize: bool = False
+    line_number: int = field(default=1, compare=False)
+    _blocks: List[TemplateBlock] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def blocks(self):
+        if self._blocks is None:
+            self._blocks = _parse_lazy(self.source, self.start, self.stop, self.optimize, self.line_number)
+
+        return self._blocks
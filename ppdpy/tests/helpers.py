@@ -0,0 +1,327 @@
+"""
+Fixtures and reference implementations shared by the tests.
+"""
+from itertools import combinations
+
+from ppdpy import compiles
+from ppdpy.exceptions import ExpressionSyntaxError
+from ppdpy.expression_compiler import _is_id, Id, Not, And, Or, LP, RP, TK_AND, TK_OR, TK_NOT
+from ppdpy.template_compiler import ENGINES
+from ppdpy.utility import listview
+
+
+TEMPLATES = [
+    '',
+    'foobar',
+    'foobar\n',
+    """
+line 1
+#if a or b
+line 2
+#elif c
+line 3
+#else
+line 4
+#endif
+line 5
+""",
+    """line 1
+#if a
+#elif b
+#else
+#endif
+""",
+    """
+#if a and (b or c)
+    #if not d
+line 1
+    #elif b
+line 2 'quoted' "double" \\ backslash
+    #endif
+#elif a or d
+line 3
+    #if c
+    #else
+line 4
+    #endif
+#endif
+#if b
+last line
+#endif""",
+    """
+#if a
+line 1
+#endif
+#if a
+line 2
+#else
+#endif
+""",
+]
+
+SYMBOLS = 'abcde'
+
+
+def all_symbol_sets(symbols=SYMBOLS):
+    for n in range(len(symbols) + 1):
+        for combination in combinations(symbols, n):
+            yield set(combination)
+
+
+def render_cases(texts=TEMPLATES, engines=ENGINES, lazy=(False, ), symbols=SYMBOLS, prepare=None):
+    """
+    Compiles each text with each engine and lazy option, and yields the
+    (reference, template, symbols set) cases to compare, for every set of
+    the given symbols. The reference is the text compiled without options
+    nor optimizations. `prepare`, when given, is called with each compiled
+    template, and returns the template to compare.
+    """
+    for text in texts:
+        reference = compiles(text, optimize=False)
+
+        for engine in engines:
+            for lazy_option in lazy:
+                template = compiles(text, engine, lazy=lazy_option)
+
+                if prepare is not None:
+                    template = prepare(template)
+
+                for symbols_set in all_symbol_sets(symbols):
+                    yield reference, template, symbols_set
+
+
+# templates that the optimizer simplifies
+REDUNDANT_TEMPLATES = [
+    'line 1\n#if not (not a)\nline 2\n#endif\nline 3',
+    '#if a and a\nline 1\n#elif a or (a and b)\nline 2\n#elif b and not b\nline 3\n#endif',
+    '#if a\nline 1\n#elif not a\nline 2\n#elif b\nline 3\n#else\nline 4\n#endif\n',
+    '#if a or not a\nline 1\n#else\nline 2\n#endif\nline 3\n',
+    '#if a\n#if b\n#endif\n#endif\n#if c\nline 1\n#elif d\n#else\n#endif',
+    '#if (a or b) and (not a or b)\nline 1\n#elif b\nline 2\n#endif',
+]
+
+
+def random_expression(random, depth=2):
+    choice = random.random()
+
+    if depth == 0 or choice < 0.3:
+        return random.choice('abcd')
+
+    elif choice < 0.45:
+        return 'not (' + random_expression(random, depth - 1) + ')'
+
+    operator = random.choice((' and ', ' or '))
+    return '(' + random_expression(random, depth - 1) + operator + random_expression(random, depth - 1) + ')'
+
+
+def random_template(random, depth=3):
+    """
+    The lines of a random template of nested conditionals on a, b, c and d.
+    """
+    lines = []
+
+    for _ in range(random.randint(0, 3)):
+        if depth and random.random() < 0.5:
+            lines.append('#if ' + random_expression(random))
+            lines.extend(random_template(random, depth - 1))
+
+            for _ in range(random.randint(0, 2)):
+                lines.append('#elif ' + random_expression(random))
+                lines.extend(random_template(random, depth - 1))
+
+            if random.random() < 0.5:
+                lines.append('#else')
+                lines.extend(random_template(random, depth - 1))
+
+            lines.append('#endif')
+
+        else:
+            lines.append(random.choice(('', 'line %d' % len(lines))))
+
+    return lines
+
+
+def char_lex(text:str):
+    """
+    Splits a text to tokens one character at a time (the lexer replaced by
+    the regular expression one).
+    """
+    def _clear(token):
+        tl = token.lower()
+        return tl if tl in (TK_AND, TK_OR, TK_NOT) else token
+
+    token = ''
+
+    for char in text:
+        if char == ' ':
+            if token:
+                yield _clear(token)
+                token = ''
+
+            continue
+
+        elif char == LP:
+            if token:
+                yield _clear(token)
+                token = ''
+
+            yield LP
+
+        elif char == RP:
+            if token:
+                yield _clear(token)
+                token = ''
+
+            yield RP
+
+        else:
+            token += char
+
+    if token:
+        yield _clear(token)
+        token = ''
+
+
+def recursive_parse(tokens):
+    """
+    Parses a list of tokens by recursive descent (the parser replaced by the
+    iterative one).
+    """
+    try:
+        if len(tokens) == 0:
+            raise ExpressionSyntaxError('empty expression')
+
+        node, remainder = _parse_expr(listview(tokens))
+
+        if remainder:
+            raise ExpressionSyntaxError()
+
+        return node
+
+    except StopIteration:
+        raise ExpressionSyntaxError
+
+
+def _parse_expr(tokens):
+    """
+    Tries to parse a new expression, beginning with the left side of it.
+    """
+    head, tail = tokens.walk()
+
+    if head == TK_NOT:
+        # parses: not TOKEN
+        return _parse_expr_not(tail)
+
+    elif head == LP:
+        # parses: (EXPRESSION)
+        node, remainder = _parse_parens_contents(tokens)
+        return _parse_cont(node, remainder)
+
+    elif _is_id(head):
+        # parses: ID
+        node = Id(head)
+        return _parse_cont(node, tail)
+
+    else:
+        raise ExpressionSyntaxError('error parsing expression beginning')
+
+
+def _parse_expr_not(tokens):
+    head = tokens.head
+
+    if _is_id(head):
+        # parses: not ID
+        node = Not(Id(head))
+        return _parse_cont(node, tokens.tail)
+
+    elif head == LP:
+        # parses: not (EXPRESSION)
+        node, remainder = _parse_parens_contents(tokens)
+        return _parse_cont(Not(node), remainder)
+
+    else:
+        raise ExpressionSyntaxError()
+
+
+def _parse_cont(left, tokens):
+    """
+    Tries to parse an operator and the right side of the expression.
+    """
+    if len(tokens) == 0:
+        # nothing left to parse
+        return left, []
+
+    head, tail = tokens.walk()
+
+    if head == RP:
+        # found a closing parens
+        return left, tokens
+
+    elif head == TK_OR:
+        # parses: LEFT or RIGHT
+        # does a late binding on "left or right" (low precedence)
+        right, remainder = _parse_expr(tail)
+        return Or(left, right), remainder
+
+    elif head == TK_AND:
+        # parses: LEFT and RIGHT
+        return _parse_cont_and(left, tail)
+
+    else:
+        raise ExpressionSyntaxError()
+
+
+def _parse_cont_and(left, tokens):
+    # parses: LEFT and RIGHT
+    # Does an early binding on "left and right" (high precedence)
+    head, tail = tokens.walk()
+
+    if _is_id(head):
+        # parses: LEFT and ID
+        right = Id(head)
+        node = And(left, right)
+        return _parse_cont(node, tail)
+
+    elif head == LP:
+        # parses: LEFT and (EXPRESSION)
+        right, remainder = _parse_parens_contents(tokens)
+        node = And(left, right)
+        return _parse_cont(node, remainder)
+
+    elif head == TK_NOT:
+        head2 = tail.head
+
+        if _is_id(head2):
+            # parses: LEFT and not ID
+            right = Not(Id(head2))
+            node = And(left, right)
+            return _parse_cont(node, tail.tail)
+
+        elif head2 == LP:
+            # parses: LEFT and not (EXPRESSION)
+            right, remainder = _parse_parens_contents(tail)
+            node = And(left, Not(right))
+            return _parse_cont(node, remainder)
+
+        else:
+            raise ExpressionSyntaxError()
+
+    else:
+        raise ExpressionSyntaxError('unexpected token after and')
+
+
+def _parse_parens_contents(tokens):
+    head, tail = tokens.walk()
+
+    if head != LP:
+        raise ExpressionSyntaxError('left parens expected')
+
+    node, remainder = _parse_expr(tail)
+    if not remainder:
+        raise ExpressionSyntaxError('right parens expected')
+
+    elif remainder.head == RP:
+        return node, remainder.tail
+
+    else:
+        raise ExpressionSyntaxError('right parens expected')
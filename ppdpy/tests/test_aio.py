@@ -0,0 +1,71 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase
+
+import ppdpy
+from ppdpy import compiles
+
+
+TEMPLATE = 'line 1\n#if a\nline 2\n#else\nline 3\n#endif\nline 4\n'
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b''
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+
+class TestAio(IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.directory = directory.name
+        with open(os.path.join(self.directory, 'template.txt'), 'w') as f:
+            f.write(TEMPLATE)
+
+    async def test_acompile_path(self):
+        template = await ppdpy.acompile_path(os.path.join(self.directory, 'template.txt'), lazy=True)
+        self.assertEqual(template.render({'a'}), 'line 1\nline 2\nline 4')
+
+    async def test_loader(self):
+        loader = ppdpy.AsyncTemplateLoader(self.directory)
+        calls = []
+        get = loader.loader.get
+
+        def slow_get(name):
+            calls.append(threading.current_thread().name)
+            time.sleep(0.05)
+            return get(name)
+
+        loader.loader.get = slow_get
+        templates = await asyncio.gather(*[loader.get('template.txt') for _ in range(5)])
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(calls[0].startswith('ppdpy'))
+        self.assertTrue(all(template is templates[0] for template in templates))
+        self.assertIs(await loader.get('template.txt'), templates[0])
+        self.assertEqual(len(calls), 1)
+
+    async def test_arender_iter(self):
+        template = compiles(TEMPLATE)
+        chunks = [chunk async for chunk in template.arender_iter({'a'})]
+        self.assertEqual(chunks, list(template.render_iter({'a'})))
+
+    async def test_render_to_stream(self):
+        template = compiles('línea 1\n#if a\nlínea 2\n#endif')
+        writer = _Writer()
+
+        written = await template.render_to_stream(writer, {'a'})
+        self.assertEqual(writer.data, 'línea 1\nlínea 2'.encode('utf-8'))
+        self.assertEqual(written, len(writer.data))
+        self.assertEqual(writer.drains, 2)
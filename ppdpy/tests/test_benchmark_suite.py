@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import TestCase
+
+from ppdpy import compiles
+from ppdpy.benchmarks import suite
+
+
+TINY = suite.Shape('tiny', text_lines=1, directives=3, symbols=4)
+
+METRICS = {'lex', 'parse', 'compile', 'compile_unoptimized', 'render', 'compile_peak_memory',
+           'render_peak_memory'}
+
+
+class TestSuite(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _save(self, results, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump(results, f)
+
+        return path
+
+    def test_generate_template(self):
+        text = suite.generate_template(TINY)
+        self.assertEqual(text, suite.generate_template(TINY))
+        self.assertEqual(text.count('#if '), 3)
+        compiles(text)
+
+    def test_run(self):
+        results = suite.run([TINY], number=1, repeat=1)
+        self.assertEqual(json.loads(json.dumps(results)), results)
+        self.assertEqual(results['engine'], 'interpreter')
+
+        shape = results['shapes']['tiny']
+        self.assertEqual(shape['directives'], 3)
+        self.assertEqual(set(shape['results']), METRICS)
+        self.assertTrue(all(value > 0 for value in shape['results'].values()))
+
+    def test_compare(self):
+        results = {'shapes': {'tiny': {'results': {'compile': 1.0, 'render': 1.0, 'new': 1.0}},
+                              'new_shape': {'results': {'compile': 1.0}}}}
+        baseline = {'shapes': {'tiny': {'results': {'compile': 0.5, 'render': 0.95}}}}
+
+        self.assertEqual(suite.compare(results, baseline), [('tiny', 'compile', 0.5, 1.0)])
+        self.assertEqual(suite.compare(results, baseline, threshold=0.01),
+                         [('tiny', 'compile', 0.5, 1.0), ('tiny', 'render', 0.95, 1.0)])
+        self.assertEqual(suite.compare(results, results), [])
+
+    def test_main(self):
+        path = os.path.join(self.directory, 'results.json')
+        self.assertEqual(suite.main(['--shape', 'small', '--output', path]), 0)
+
+        with open(path) as f:
+            results = json.load(f)
+
+        self.assertEqual(list(results['shapes']), ['small'])
+        self.assertEqual(set(results['shapes']['small']['results']), METRICS)
+
+        slow = {'shapes': {'small': {'results': {metric: value * 1000
+                                                 for metric, value in results['shapes']['small']['results'].items()}}}}
+        out = StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(suite.main(['--shape', 'small', '--compare', self._save(slow, 'slow.json')]), 0)
+
+        self.assertEqual(out.getvalue(), 'no regressions\n')
+
+        fast = {'shapes': {'small': {'results': {'compile': 1e-12}}}}
+        out = StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(suite.main(['--shape', 'small', '--compare', self._save(fast, 'fast.json')]), 1)
+
+        self.assertIn('compile', out.getvalue())
+        self.assertNotIn('no regressions', out.getvalue())
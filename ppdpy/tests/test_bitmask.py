@@ -0,0 +1,26 @@
+from unittest import TestCase
+
+from ppdpy import compiles
+from ppdpy.bitmask import assign_bits, symbols_mask
+from ppdpy.template_compiler import ENGINE_BITMASK
+
+
+class TestBitmask(TestCase):
+    def test_assign_bits(self):
+        template = compiles('#if b and not a\n#elif c or b\n#if d\n#endif\n#endif', optimize=False)
+        self.assertEqual(assign_bits(template.blocks), {'b': 1, 'a': 2, 'c': 4, 'd': 8})
+        self.assertEqual(assign_bits(compiles('foo').blocks), {})
+
+    def test_symbols_mask(self):
+        symbols_bits = [('a', 1), ('b', 2), ('c', 4)]
+        self.assertEqual(symbols_mask(symbols_bits, set()), 0)
+        self.assertEqual(symbols_mask(symbols_bits, {'a', 'c', 'x'}), 5)
+        self.assertEqual(symbols_mask(symbols_bits, {'b': True}.keys()), 2)
+
+    def test_symbols_types(self):
+        template = compiles('#if a\nfoo\n#else\nbar\n#endif', ENGINE_BITMASK)
+        self.assertEqual(template.render({'a'}), 'foo')
+        self.assertEqual(template.render(frozenset({'a'})), 'foo')
+        self.assertEqual(template.render({'a': 1}), 'foo')
+        self.assertEqual(template.render(['a']), 'foo')
+        self.assertEqual(template.render(['b']), 'bar')
@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from ppdpy import compiles
+from ppdpy.codegen import generate_source
+from ppdpy.template_compiler import ENGINE_CODEGEN
+from ppdpy.tests.helpers import render_cases
+
+
+class TestCodegen(TestCase):
+    def test_engines_render_the_same(self):
+        for reference, template, symbols in render_cases():
+            self.assertEqual(template.render(symbols), reference.render(symbols), (template.engine, symbols))
+
+    def test_source(self):
+        template = compiles('line 1\n#if a\nline 2\n#else\n#endif\nline 3', ENGINE_CODEGEN, optimize=False)
+        source = generate_source(template.blocks)
+
+        self.assertIn("if 'a' in symbols:", source)
+        self.assertIn("append('line 2\\n')", source)
+        self.assertIn("else:\n        pass", source)
+
+    def test_renderer_is_cached(self):
+        template = compiles('#if a\nfoo\n#endif', ENGINE_CODEGEN)
+        self.assertEqual(template.render({'a'}), 'foo')
+        renderer = template.renderer
+        self.assertEqual(template.render(set()), '')
+        self.assertIs(template.renderer, renderer)
+
+    def test_deep_nesting_fallback(self):
+        depth = 120
+        text = '\n'.join(['#if a'] * depth + ['foo'] + ['#endif'] * depth)
+        template = compiles(text, ENGINE_CODEGEN)
+        self.assertEqual(template.render({'a'}), 'foo')
+        self.assertEqual(template.render(set()), '')
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            compiles('foo', 'unknown')
@@ -0,0 +1,137 @@
+import os
+import pickle
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import ppdpy
+from ppdpy import compile_path, compiled_cache, Compiler
+from ppdpy.template_compiler import ConditionalBlock, LazyBlock
+
+
+TEMPLATE = b"""line 1
+#if a or b
+line 2
+#elif c
+line 3
+#else
+line 4
+#endif
+line 5
+"""
+
+
+class TestCompiledCache(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.cache_dir = os.path.join(directory.name, 'cache')
+        self.path = os.path.join(directory.name, 'template.txt')
+        self._write(TEMPLATE)
+
+    def _write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def _cache_files(self):
+        return os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []
+
+    def test_load(self):
+        template = compile_path(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(len(self._cache_files()), 1)
+
+        cached = compile_path(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(cached, template)
+        self.assertIn('compiled_entries', cached.blocks[1].__dict__)
+
+        for symbols in ({'a'}, {'c'}, set()):
+            self.assertEqual(cached.render(symbols), template.render(symbols))
+
+    def test_lazy(self):
+        compile_path(self.path, lazy=True, cache_dir=self.cache_dir)
+        cached = compile_path(self.path, lazy=True, cache_dir=self.cache_dir)
+
+        self.assertIsInstance(cached.blocks[1].if_entries[0][1][0], LazyBlock)
+        self.assertEqual(cached.render({'c'}), 'line 1\nline 3\nline 5')
+
+    def test_invalidation(self):
+        cache_file = compiled_cache.cache_file(self.cache_dir, self.path, '#', 'utf-8', False)
+        compile_path(self.path, cache_dir=self.cache_dir)
+
+        with open(cache_file, 'rb') as f:
+            contents = f.read()
+
+        self._write(TEMPLATE.replace(b'line 2', b'changed'))
+        self.assertEqual(compile_path(self.path, cache_dir=self.cache_dir).render({'a'}),
+                         'line 1\nchanged\nline 5')
+
+        with open(cache_file, 'rb') as f:
+            self.assertNotEqual(f.read(), contents)
+
+        try:
+            ppdpy.set_directive_prefix('%')
+            self.assertEqual(compile_path(self.path, cache_dir=self.cache_dir).render({'a'}),
+                             TEMPLATE.replace(b'line 2', b'changed').decode()[:-1])
+
+        finally:
+            ppdpy.set_directive_prefix('#')
+
+    def test_prefixes(self):
+        self._write(TEMPLATE + b'%if a\nline 6\n%endif\n')
+        compilers = [Compiler('#'), Compiler('%')]
+        templates = [compiler.compile_path(self.path, cache_dir=self.cache_dir) for compiler in compilers]
+        self.assertEqual(len(self._cache_files()), 2)
+
+        cache_files = [os.path.join(self.cache_dir, name) for name in self._cache_files()]
+        inodes = [os.stat(cache_file).st_ino for cache_file in cache_files]
+
+        for compiler, template in zip(compilers, templates):
+            self.assertEqual(compiler.compile_path(self.path, cache_dir=self.cache_dir), template)
+
+        # loaded from their cache files, which are not written again
+        self.assertEqual([os.stat(cache_file).st_ino for cache_file in cache_files], inodes)
+
+    def test_broken_file(self):
+        cache_file = compiled_cache.cache_file(self.cache_dir, self.path, '#', 'utf-8', False)
+        compile_path(self.path, cache_dir=self.cache_dir)
+
+        with open(cache_file, 'r+b') as f:
+            f.seek(40)
+            f.write(b'garbage')
+
+        self.assertEqual(compile_path(self.path, cache_dir=self.cache_dir).render({'c'}),
+                         'line 1\nline 3\nline 5')
+
+    def test_unwritable_directory(self):
+        with open(self.cache_dir, 'w'):
+            pass
+
+        self.assertEqual(compile_path(self.path, cache_dir=self.cache_dir).render({'c'}),
+                         'line 1\nline 3\nline 5')
+
+    def test_deep_expression(self):
+        self._write(b'#if ' + b' or '.join(b's%d' % i for i in range(1000)) + b'\nline\n#endif\n')
+        template = compile_path(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(len(self._cache_files()), 1)
+
+        cached = compile_path(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(cached, template)
+        self.assertEqual(cached.render({'s999'}), 'line')
+        self.assertEqual(cached.render({'other'}), '')
+
+    def test_unpicklable_tree(self):
+        with patch.object(compiled_cache._Pickler, 'dump', side_effect=pickle.PicklingError):
+            template = compile_path(self.path, cache_dir=self.cache_dir)
+
+        self.assertEqual(template.render({'c'}), 'line 1\nline 3\nline 5')
+        self.assertEqual(self._cache_files(), [])
+
+    def test_pickle_template(self):
+        template = ppdpy.compiles(TEMPLATE.decode(), engine='codegen')
+        template.render({'a'})
+
+        loaded = pickle.loads(pickle.dumps(template))
+        self.assertEqual(loaded, template)
+        self.assertIsInstance(loaded.blocks[1], ConditionalBlock)
+        self.assertEqual(loaded.render({'c'}), template.render({'c'}))
@@ -1,8 +1,16 @@
+import pickle
+import sys
+import threading
+from copy import deepcopy
+from itertools import product
+from random import Random
 from unittest import TestCase
 
-from ppdpy.expression_compiler import lex, compile, Id, Not, And, Or, \
-    evaluate as evalexpr
+from ppdpy.expression_compiler import lex, parse, compile, Id, Not, And, Or, \
+    TrueNode, FalseNode, simplify, truth_table, evaluate as evalexpr, to_source, compile_predicate, \
+    symbols_of, to_mask_source, compile_mask_predicate, LP, RP, TK_AND, TK_OR, TK_NOT, _interned
 from ppdpy.exceptions import ExpressionSyntaxError
+from ppdpy.tests.helpers import all_symbol_sets, char_lex, recursive_parse
 
 
 class TestLex(TestCase):
@@ -48,6 +56,23 @@ class TestLex(TestCase):
         self.assertEqual(list(lex('  a    and  (b   or  c) ')), ['a', 'and', '(', 'b', 'or', 'c', ')'])
 
 
+    def test_operators(self):
+        self.assertEqual(lex('a AnD b oR NoT c'), ['a', 'and', 'b', 'or', 'not', 'c'])
+        self.assertEqual(lex('ands nota (Or)'), ['ands', 'nota', '(', 'or', ')'])
+
+    def test_separators(self):
+        self.assertEqual(lex('a\tand b'), ['a\tand', 'b'])
+        self.assertEqual(lex('a\nb or ç!'), ['a\nb', 'or', 'ç!'])
+
+    def test_same_as_char_lexer(self):
+        random = Random(0)
+        alphabet = 'aAnNdDoOrRtT ()\t!é'
+
+        for _ in range(2000):
+            text = ''.join(random.choice(alphabet) for _ in range(random.randint(0, 20)))
+            self.assertEqual(lex(text), list(char_lex(text)), text)
+
+
 class TestParse(TestCase):
     def test_sanity(self):
         """
@@ -228,6 +253,189 @@ class TestParse(TestCase):
         with self.assertRaises(ExpressionSyntaxError):
             compile('(a and b) or c)')
 
+        with self.assertRaises(ExpressionSyntaxError):
+            compile('not not a')
+
+    def test_long_expressions(self):
+        count = 50000
+
+        node = compile(' or '.join('s%d' % i for i in range(count)))
+        for i in range(count - 1):
+            self.assertIsInstance(node, Or)
+            self.assertEqual(node.left, Id('s%d' % i))
+            node = node.right
+
+        self.assertEqual(node, Id('s%d' % (count - 1)))
+
+        node = compile(' and '.join('not s%d' % i for i in range(count)))
+        for i in reversed(range(1, count)):
+            self.assertIsInstance(node, And)
+            self.assertEqual(node.right, Not(Id('s%d' % i)))
+            node = node.left
+
+        self.assertEqual(node, Not(Id('s0')))
+
+        node = compile('(' * count + 'a' + ')' * count)
+        self.assertEqual(node, Id('a'))
+
+    def test_same_as_recursive_parser(self):
+        vocabulary = ['a', 'b', LP, RP, TK_AND, TK_OR, TK_NOT]
+
+        def _parse(parser, tokens):
+            try:
+                return repr(parser(tokens))
+
+            except ExpressionSyntaxError as e:
+                return 'error: ' + str(e)
+
+        for length in range(1, 6):
+            for tokens in product(vocabulary, repeat=length):
+                tokens = list(tokens)
+                self.assertEqual(_parse(parse, tokens), _parse(recursive_parse, tokens), tokens)
+
+
+class TestInterning(TestCase):
+    def test_identity(self):
+        self.assertIs(Id('a'), Id('a'))
+        self.assertIs(TrueNode(), TrueNode())
+        self.assertIs(compile('a and not (b or c)').right.node.left, Id('b'))
+
+    def test_equality(self):
+        self.assertEqual(compile('a and not (b or c)'), compile('(a) and not (b or c)'))
+        self.assertNotEqual(compile('a and b'), compile('b and a'))
+        self.assertNotEqual(compile('a and b'), compile('a or b'))
+
+        node = compile('a or b and c')
+        self.assertEqual(node.right, compile('b and c'))
+        self.assertEqual(len({node, compile('a or (b and c)')}), 1)
+
+    def test_deep_equality(self):
+        text = ' or '.join('s%d' % i for i in range(sys.getrecursionlimit() * 2))
+        self.assertEqual(compile(text), compile(text))
+        self.assertNotEqual(compile(text), compile(text + ' or t'))
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            Id('a').id = 'b'
+
+    def test_pickle(self):
+        node = compile('a and not (b or c)')
+        self.assertEqual(pickle.loads(pickle.dumps(node)), node)
+        self.assertIs(pickle.loads(pickle.dumps(node)).left, Id('a'))
+        self.assertIs(deepcopy(node), node)
+
+    def test_released(self):
+        node = compile(' or '.join('unique_%d' % i for i in range(100)))
+        self.assertIs(_interned['unique_0'](), node.left)
+
+        del node
+        self.assertIsNone(_interned['unique_0']())
+
+        # dead references are dropped as the table grows
+        nodes = [Id('growing_%d' % i) for i in range(len(_interned) * 2)]
+        self.assertNotIn('unique_0', _interned)
+        self.assertIs(_interned['growing_0'](), nodes[0])
+
+    def test_threads(self):
+        errors = []
+
+        def _intern_nodes():
+            for i in range(20000):
+                # the nodes of some symbols are dropped, and the table swept
+                key = 'k%d' % (i % 3) if i % 2 else 't%d' % i
+                node = Id(key)
+
+                if node.id != key or node != Id(key) or hash(node) != hash(Id(key)):
+                    errors.append(node)
+
+        unraisablehook = sys.unraisablehook
+        switch_interval = sys.getswitchinterval()
+        sys.unraisablehook = errors.append
+        sys.setswitchinterval(1e-6)
+
+        try:
+            threads = [threading.Thread(target=_intern_nodes) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        finally:
+            sys.unraisablehook = unraisablehook
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+
+    def test_shared_predicates(self):
+        node = compile('a and b')
+        self.assertIs(compile_predicate(node), compile_predicate(compile('a and b')))
+
+
+class TestSimplify(TestCase):
+    def test_simplify(self):
+        self.assertIs(simplify(compile('not (not a)')), Id('a'))
+        self.assertIs(simplify(compile('a and a')), Id('a'))
+        self.assertIs(simplify(compile('a or (a and b)')), Id('a'))
+        self.assertIs(simplify(compile('(b or a) and a')), Id('a'))
+        self.assertIs(simplify(compile('a and b and not a')), FalseNode())
+        self.assertIs(simplify(compile('not a or b or a')), TrueNode())
+        self.assertIs(simplify(Not(TrueNode())), FalseNode())
+        self.assertIs(simplify(And(TrueNode(), Id('a'))), Id('a'))
+        self.assertIs(simplify(Or(Id('a'), FalseNode())), Id('a'))
+        self.assertEqual(simplify(compile('(a and b) and (c and a)')), compile('a and b and c'))
+        self.assertEqual(simplify(compile('a or (b or a) or c')), compile('a or b or c'))
+
+    def test_same_as_evaluate(self):
+        random = Random(0)
+
+        def _random_node(depth):
+            choice = random.random()
+
+            if depth == 0 or choice < 0.3:
+                return Id(random.choice('abc'))
+
+            elif choice < 0.45:
+                return Not(_random_node(depth - 1))
+
+            elif choice < 0.5:
+                return random.choice((TrueNode(), FalseNode()))
+
+            return random.choice((And, Or))(_random_node(depth - 1), _random_node(depth - 1))
+
+        for _ in range(1000):
+            node = _random_node(5)
+            simplified = simplify(node)
+
+            for symbols in all_symbol_sets('abc'):
+                self.assertEqual(evalexpr(simplified, symbols), evalexpr(node, symbols), node)
+
+    def test_cached(self):
+        node = compile('a and not (b or c)')
+        self.assertIs(simplify(node), node)
+        self.assertIs(simplify(node), node)
+
+        node = compile('a and not (b or c) and a')
+        simplified = simplify(node)
+        self.assertEqual(simplified, compile('a and not (b or c)'))
+        self.assertIs(simplify(node), simplified)
+        self.assertIs(simplify(compile('a and not (b or c) and a')), simplified)
+        self.assertIs(simplify(node, {'b': True}), FalseNode())
+
+    def test_truth_table(self):
+        symbols = ['a', 'b', 'c']
+
+        for text in EXPRESSIONS:
+            node = compile(text)
+            table = truth_table(node, symbols)
+
+            for mask in range(8):
+                assigned = {symbol for i, symbol in enumerate(symbols) if mask & 1 << i}
+                self.assertEqual(bool(table & 1 << mask), evalexpr(node, assigned), (text, assigned))
+
+        self.assertEqual(truth_table(TrueNode(), symbols), 0xff)
+        self.assertEqual(truth_table(FalseNode(), symbols), 0)
+
 
 class TestEval(TestCase):
     def test_eval_simple(self):
@@ -307,3 +515,107 @@ class TestEval(TestCase):
         self.assertEqual(evalexpr(expr, {'c'}), True)
         self.assertEqual(evalexpr(expr, set()), True)
 
+
+
+EXPRESSIONS = [
+    'a',
+    'not a',
+    'a and b',
+    'a or b',
+    'a and b and c',
+    'a or b or c',
+    'a and b or c',
+    'a or b and c',
+    'not a or not b',
+    'a and not (b or c)',
+    'not (a and b) or c',
+    '(a or b) and (b or c)',
+    'not (a or b) and not (b and c)',
+    '((a)) and (((b or (c))))',
+]
+
+
+class TestCompilePredicate(TestCase):
+    def test_source(self):
+        self.assertEqual(to_source(Id('a')), "'a' in symbols")
+        self.assertEqual(to_source(Not(Id('a')), 's'), "not 'a' in s")
+        self.assertEqual(to_source(compile('a and b and c'), 's'),
+                         "'a' in s and 'b' in s and 'c' in s")
+        self.assertEqual(to_source(compile('a and not (b or c)'), 's'),
+                         "'a' in s and not ('b' in s or 'c' in s)")
+        self.assertEqual(to_source(compile('(a or b) and c'), 's'),
+                         "('a' in s or 'b' in s) and 'c' in s")
+        self.assertEqual(to_source(TrueNode()), 'True')
+
+    def test_exotic_symbols(self):
+        predicate = compile_predicate(compile("it's and \\n\""))
+        self.assertTrue(predicate({"it's", '\\n"'}))
+        self.assertFalse(predicate({"it's"}))
+
+    def test_same_as_evaluate(self):
+        for text in EXPRESSIONS:
+            expression = compile(text)
+            predicate = compile_predicate(expression)
+
+            for symbols in all_symbol_sets('abcd'):
+                self.assertEqual(predicate(symbols), evalexpr(expression, symbols),
+                                 (text, symbols))
+
+    def test_true_node(self):
+        self.assertTrue(compile_predicate(TrueNode())(set()))
+
+    def test_deep_nesting(self):
+        expression = compile('(a or (b and ' * 500 + 'c' + '))' * 500)
+        self.assertTrue(evalexpr(expression, {'b', 'c'}))
+        self.assertFalse(evalexpr(expression, {'b'}))
+
+        predicate = compile_predicate(expression)
+        self.assertTrue(predicate({'b', 'c'}))
+        self.assertFalse(predicate({'b'}))
+
+    def test_long_chain(self):
+        expression = compile(' or '.join('s%d' % i for i in range(200)))
+        predicate = compile_predicate(expression)
+        self.assertTrue(predicate({'s199'}))
+        self.assertFalse(predicate({'s200'}))
+
+
+class TestMaskPredicate(TestCase):
+    BITS = {'a': 1, 'b': 2, 'c': 4, 'd': 8}
+
+    def test_symbols_of(self):
+        self.assertEqual(symbols_of(compile('a')), ['a'])
+        self.assertEqual(symbols_of(compile('b and not (a or b) or c')), ['b', 'a', 'c'])
+        self.assertEqual(symbols_of(TrueNode()), [])
+
+    def test_source(self):
+        self.assertEqual(to_mask_source(compile('a'), self.BITS), 'mask & 1')
+        self.assertEqual(to_mask_source(compile('not b'), self.BITS), 'not mask & 2')
+        self.assertEqual(to_mask_source(compile('a and b and not c'), self.BITS),
+                         '(mask & 3 == 3) and (not mask & 4)')
+        self.assertEqual(to_mask_source(compile('a or b or c'), self.BITS), '(mask & 7)')
+        self.assertEqual(to_mask_source(compile('a and (b or not c)'), self.BITS),
+                         '(mask & 1 == 1) and ((mask & 2) or (mask & 4 != 4))')
+
+    def test_same_as_evaluate(self):
+        for text in EXPRESSIONS:
+            expression = compile(text)
+            predicate = compile_mask_predicate(expression, self.BITS)
+
+            for symbols in all_symbol_sets('abcd'):
+                mask = sum(self.BITS[s] for s in symbols)
+                self.assertEqual(bool(predicate(mask)), evalexpr(expression, symbols),
+                                 (text, symbols))
+
+    def test_deep_nesting(self):
+        expression = compile('(a or (b and ' * 500 + 'c' + '))' * 500)
+        predicate = compile_mask_predicate(expression, self.BITS)
+        self.assertTrue(predicate(6))
+        self.assertFalse(predicate(2))
+
+    def test_large_masks(self):
+        count = 20000
+        bits = {'s%d' % i: 1 << i for i in range(count)}
+        predicate = compile_mask_predicate(compile(' or '.join(bits)), bits)
+        self.assertTrue(predicate(1 << (count - 1)))
+        self.assertFalse(predicate(0))
@@ -0,0 +1,164 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from ppdpy import TemplateLoader
+from ppdpy.exceptions import TemplateNotFoundError
+import ppdpy.loader
+
+
+class TestTemplateLoader(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.root = directory.name
+        self.first = os.path.join(self.root, 'first')
+        self.second = os.path.join(self.root, 'second')
+        os.makedirs(os.path.join(self.first, 'sub'))
+        os.makedirs(self.second)
+
+        self._write(self.first, 'a.sql', 'select a\n#if x\nwhere x\n#endif\n')
+        self._write(self.second, 'a.sql', 'shadowed\n')
+        self._write(self.second, 'b.sql', 'select b\n')
+        self._write(self.first, 'sub/c.sql', 'select c\n')
+        self._write(self.root, 'secret.sql', 'secret\n')
+
+    def _write(self, directory, name, text, mtime=None):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_get(self):
+        loader = TemplateLoader([self.first, self.second])
+
+        template = loader.get('a.sql')
+        self.assertEqual(template.render({'x'}), 'select a\nwhere x')
+        self.assertIs(loader.get('a.sql'), template)
+
+        self.assertEqual(loader.get('b.sql').render(set()), 'select b')
+        self.assertEqual(loader.get('sub/c.sql').render(set()), 'select c')
+        self.assertEqual(len(loader), 3)
+
+    def test_not_found(self):
+        loader = TemplateLoader(self.first)
+
+        with self.assertRaises(TemplateNotFoundError):
+            loader.get('missing.sql')
+
+        with self.assertRaises(TemplateNotFoundError):
+            loader.get('../secret.sql')
+
+        with self.assertRaises(TemplateNotFoundError):
+            loader.get(os.path.join(self.root, 'secret.sql'))
+
+    def test_removed_after_found(self):
+        loader = TemplateLoader(self.first)
+        find = loader.find
+
+        def find_and_remove(name):
+            path = find(name)
+            os.remove(path)
+            return path
+
+        with patch.object(loader, 'find', find_and_remove):
+            with self.assertRaises(TemplateNotFoundError):
+                loader.get('a.sql')
+
+        self.assertEqual(len(loader), 0)
+
+    def test_reload(self):
+        loader = TemplateLoader(self.first, check_interval=0)
+        template = loader.get('a.sql')
+        self.assertIs(loader.get('a.sql'), template)
+
+        self._write(self.first, 'a.sql', 'changed\n', mtime=1)
+        changed = loader.get('a.sql')
+        self.assertIsNot(changed, template)
+        self.assertEqual(changed.render(set()), 'changed')
+
+        loader = TemplateLoader(self.first, auto_reload=False)
+        template = loader.get('a.sql')
+        self._write(self.first, 'a.sql', 'changed again\n', mtime=2)
+        self.assertIs(loader.get('a.sql'), template)
+
+    def test_eviction(self):
+        loader = TemplateLoader([self.first, self.second], max_templates=2)
+        loader.get('a.sql')
+        loader.get('b.sql')
+        loader.get('a.sql')
+        loader.get('sub/c.sql')
+        self.assertEqual((('a.sql' in loader), ('b.sql' in loader), ('sub/c.sql' in loader)),
+                         (True, False, True))
+
+        loader = TemplateLoader([self.first, self.second], max_bytes=20)
+        loader.get('b.sql')
+        loader.get('sub/c.sql')
+        self.assertEqual(len(loader), 2)
+        loader.get('a.sql')
+        self.assertEqual(len(loader), 1)
+
+        loader.clear()
+        self.assertEqual(len(loader), 0)
+
+    def test_concurrent_first_access(self):
+        loader = TemplateLoader(self.first)
+        calls = []
+        barrier = threading.Barrier(8)
+        compile_path = ppdpy.loader.compile_path
+
+        def counting_compile_path(*args, **kwargs):
+            calls.append(args)
+            return compile_path(*args, **kwargs)
+
+        def get():
+            barrier.wait()
+            results.append(loader.get('a.sql'))
+
+        results = []
+        with patch('ppdpy.loader.compile_path', counting_compile_path):
+            threads = [threading.Thread(target=get) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+    def test_prefix(self):
+        self._write(self.first, 'd.sh', 'echo d\n--#if x\necho x\n--#endif\n')
+        loader = TemplateLoader(self.first, prefix='--#')
+
+        self.assertEqual(loader.get('d.sh').render({'x'}), 'echo d\necho x')
+        self.assertEqual(loader.get('a.sql').render({'x'}), 'select a\n#if x\nwhere x\n#endif')
+
+    def test_file_changed(self):
+        loader = TemplateLoader(self.first)
+        template = loader.get('a.sql')
+        path = os.path.join(self.first, 'a.sql')
+
+        with open(path, 'r+b') as f:
+            f.write(b'SELECT B THER')
+
+        self.assertEqual(template.render({'x'}), 'select a\nwhere x')
+
+        with open(path, 'r+b') as f:
+            f.truncate(2)
+
+        self.assertEqual(template.render({'x'}), 'select a\nwhere x')
+
+    def test_name_locks_dropped(self):
+        loader = TemplateLoader(self.first)
+        loader.get('a.sql')
+
+        with self.assertRaises(TemplateNotFoundError):
+            loader.get('missing.sql')
+
+        self.assertEqual(loader._name_locks, {})
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from ppdpy import compiles, compile_path, render_parallel
+from ppdpy.tests.helpers import all_symbol_sets
+
+
+TEMPLATE = """line 1
+#if a or b
+line 2
+#elif c
+line 3
+#else
+line 4
+#endif
+#if d and not e
+line 5
+#endif"""
+
+
+class TestRenderParallel(TestCase):
+    def test_in_order(self):
+        template = compiles(TEMPLATE)
+        symbols_sets = list(all_symbol_sets()) + [['a'], {'c': 1}]
+
+        self.assertEqual(render_parallel(template, symbols_sets, workers=2, chunksize=5),
+                         [template.render(symbols) for symbols in symbols_sets])
+        self.assertEqual(render_parallel(template, [], workers=2), [])
+
+    def test_deep_expression(self):
+        text = '#if ' + ' or '.join('s%d' % i for i in range(1000)) + '\nline\n#endif'
+        symbols_sets = [{'s0'}, {'s999'}, {'other'}]
+
+        for engine in ('interpreter', 'codegen', 'bitmask'):
+            template = compiles(text, engine)
+            self.assertEqual(render_parallel(template, symbols_sets, workers=2), ['line', 'line', ''])
+
+    def test_dict_values_not_sent(self):
+        template = compiles(TEMPLATE)
+        symbols_sets = [{'a': threading.Lock(), 'unused': object()}, {'d': threading.Lock()}]
+
+        self.assertEqual(render_parallel(template, symbols_sets, workers=1),
+                         [template.render(symbols) for symbols in symbols_sets])
+
+    def test_path_template(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'template.txt')
+            with open(path, 'w') as f:
+                f.write(TEMPLATE)
+
+            template = compile_path(path)
+            self.assertEqual(render_parallel(template, [{'a'}, {'c', 'd'}], workers=2),
+                             [template.render({'a'}), template.render({'c', 'd'})])
+
+    def test_output_paths(self):
+        template = compiles(TEMPLATE)
+        symbols_sets = [{'a'}, {'c'}, set()]
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, '{}.txt'.format(i)) for i in range(len(symbols_sets))]
+            lengths = render_parallel(template, symbols_sets, workers=2, chunksize=2, output_paths=paths)
+
+            for symbols, path, length in zip(symbols_sets, paths, lengths):
+                with open(path) as f:
+                    text = f.read()
+
+                self.assertEqual(text, template.render(symbols))
+                self.assertEqual(length, len(text))
+
+    def test_bytes_template(self):
+        template = compiles(TEMPLATE.encode('utf-8'))
+        symbols_sets = [{'a'}, set()]
+        self.assertEqual(render_parallel(template, symbols_sets, workers=2), template.render_many(symbols_sets))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'output.txt')
+            self.assertEqual(render_parallel(template, [{'a'}], workers=1, output_paths=[path]),
+                             [len(template.render({'a'}))])
+
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), template.render({'a'}))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            render_parallel(TEMPLATE, [set()])
+
+        with self.assertRaises(ValueError):
+            render_parallel(compiles(TEMPLATE), [set()], chunksize=0)
@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+from ppdpy import compiles
+from ppdpy.template_compiler import ConditionalBlock, TextBlock, Template
+from ppdpy.expression_compiler import Id
+from ppdpy.tests.helpers import render_cases
+
+TEXT = 'line 1\n#if a\nline 3\n#elif b\n#if c\nline 6\n#endif\n#else\nline 9\n#endif'
+
+
+class TestProfiler(TestCase):
+    def test_same_renders(self):
+        def _profile(template):
+            template.start_profiling()
+            return template
+
+        for expected, template, symbols in render_cases(lazy=(False, True), prepare=_profile):
+            self.assertEqual(template.render(symbols), expected.render(symbols))
+
+    def test_counters(self):
+        template = compiles(TEXT)
+        profile = template.start_profiling()
+
+        template.render({'a'})
+        template.render({'b', 'c'})
+        template.render({'b'})
+        template.render(set())
+
+        report = profile.report()
+        self.assertEqual(report['renders'], 4)
+        self.assertEqual(list(report['entries']), [2, 4, 5, 8])
+        self.assertEqual({line: (entry['evaluated'], entry['selected']) for line, entry in report['entries'].items()},
+                         {2: (4, 1), 4: (3, 2), 5: (2, 1), 8: (1, 1)})
+        self.assertGreater(report['render_time'], 0)
+        self.assertAlmostEqual(report['evaluation_time'] + report['text_time'], report['render_time'])
+
+        profile.reset()
+        self.assertEqual(profile.report()['renders'], 0)
+        self.assertEqual(profile.report()['entries'][2]['evaluated'], 0)
+
+    def test_lazy(self):
+        template = compiles(TEXT, lazy=True)
+        template.start_profiling().reset()
+        template.render({'b', 'c'})
+        self.assertEqual(list(template.profile.report()['entries']), [2, 4, 5, 8])
+
+    def test_render_many(self):
+        template = compiles(TEXT)
+        profile = template.start_profiling()
+        template.render_many([{'a'}, {'a'}, {'b'}])
+        self.assertEqual(profile.report()['renders'], 2)
+
+    def test_stop_profiling(self):
+        template = compiles(TEXT, cache_size=10)
+        template.render({'a'})
+        self.assertIsNone(template.stop_profiling())
+
+        profile = template.start_profiling()
+        self.assertIs(template.start_profiling(), profile)
+        template.render({'a'})
+        self.assertIs(template.stop_profiling(), profile)
+        self.assertIsNone(template.profile)
+
+        template.render({'a'})
+        self.assertEqual(profile.renders, 1)
+        self.assertEqual(template.cache_info().hits, 1)
+
+    def test_cache_info(self):
+        template = compiles(TEXT, cache_size=10)
+        template.start_profiling()
+        template.render({'a'})
+        self.assertEqual(template.cache_info().currsize, 0)
+
+        template.stop_profiling()
+        template.render({'a'})
+        template.render({'a'})
+        self.assertEqual(template.cache_info().hits, 1)
+
+    def test_materialize(self):
+        template = compiles(TEXT)
+        profile = template.start_profiling()
+        self.assertTrue(template.materialize())
+        template.render({'a'})
+        self.assertEqual(profile.renders, 1)
+
+        template.stop_profiling()
+        self.assertEqual(template.render({'b'}), 'line 1')
+        self.assertEqual(profile.renders, 1)
+
+    def test_without_lines(self):
+        template = Template([ConditionalBlock([(Id('a'), [TextBlock('foo\n')])]), TextBlock('bar\n')])
+        profile = template.start_profiling()
+        self.assertEqual(template.render({'a'}), 'foo\nbar')
+        self.assertEqual(profile.report()['entries'][None]['selected'], 1)
@@ -1,6 +1,18 @@
 from unittest import TestCase
+from unittest.mock import patch
 
-from ppdpy import renders
+import mmap
+import os
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from random import Random
+
+from ppdpy import renders, compiles, compile, compile_path, set_directive_prefix, Compiler
+from ppdpy.template_compiler import ENGINES, ENGINE_CODEGEN, LazyBlock, ConditionalBlock, \
+    TextBlock, optimize_blocks, _WHITESPACE
+from ppdpy.expression_compiler import Id, TrueNode, truth_table
+from ppdpy.tests.helpers import TEMPLATES, REDUNDANT_TEMPLATES, all_symbol_sets, random_template, render_cases
 from ppdpy.exceptions import ExpressionSyntaxError, DirectiveSyntaxError
 
 
@@ -310,6 +322,19 @@ line 1
         self.assertEqual(renders(template, {'y'}), result)
         self.assertEqual(renders(template, {}), result)
 
+    def test_deep_expression(self):
+        expression = 'c'
+        for _ in range(500):
+            expression = '(a or (b and ' + expression + '))'
+
+        text = 'line 1\n#if ' + expression + '\nline 2\n#endif'
+
+        for engine in ENGINES:
+            for optimize in (True, False):
+                template = compiles(text, engine, optimize=optimize)
+                self.assertEqual(template.render({'b', 'c'}), 'line 1\nline 2')
+                self.assertEqual(template.render({'b'}), 'line 1')
+
     def test_error(self):
         template = """
 #if foo
@@ -418,3 +443,633 @@ line 1
 """
         with self.assertRaises(DirectiveSyntaxError):
             self.assertEqual(renders(template, {'foo'}), '')
+
+
+class TestRenderCache(TestCase):
+    TEMPLATE = """
+#if a
+line 1
+#elif b and not c
+line 2
+#endif
+"""
+
+    def test_referenced_symbols(self):
+        self.assertEqual(compiles(self.TEMPLATE).referenced_symbols, {'a', 'b', 'c'})
+        self.assertEqual(compiles('foo').referenced_symbols, frozenset())
+
+    def test_cache(self):
+        for engine in ENGINES:
+            template = compiles(self.TEMPLATE, engine, cache_size=2)
+            self.assertEqual(template.cache_info().currsize, 0)
+
+            self.assertEqual(template.render({'a', 'x'}), '\nline 1\n')
+            self.assertEqual(template.render({'a', 'y'}), '\nline 1\n')
+            self.assertEqual(template.render({'a': True}), '\nline 1\n')
+            self.assertEqual(template.render({'b', 'z'}), '\nline 2\n')
+            self.assertEqual(template.render({'b', 'c'}), '\n')
+
+            info = template.cache_info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (2, 3, 2))
+
+            template.cache_clear()
+            self.assertEqual(template.cache_info().currsize, 0)
+
+    def test_no_cache(self):
+        template = compiles(self.TEMPLATE)
+        self.assertIsNone(template.cache_info())
+        template.cache_clear()
+
+        with self.assertRaises(ValueError):
+            compiles(self.TEMPLATE, cache_size=0)
+
+
+class TestMaterialize(TestCase):
+    TEMPLATE = """line 1
+#if a or b
+line 2
+#elif c
+line 3
+#else
+line 4
+#endif
+line 5"""
+
+    def test_materialize(self):
+        def _materialize(template):
+            self.assertFalse(template.materialized)
+            self.assertTrue(template.materialize())
+            self.assertTrue(template.materialized)
+            return template
+
+        for reference, template, symbols in render_cases([self.TEMPLATE], symbols='abcd', prepare=_materialize):
+            self.assertEqual(template.render(symbols), reference.render(symbols))
+
+    def test_shared_variants(self):
+        template = compiles(self.TEMPLATE)
+        template.materialize()
+        self.assertEqual(len(template._variants), 8)
+        self.assertEqual(len(set(map(id, template._variants))), 3)
+        self.assertIs(template.render({'a'}), template.render({'b', 'c'}))
+
+    def test_too_many_variants(self):
+        template = compiles(self.TEMPLATE)
+        self.assertFalse(template.materialize(max_variants=4))
+        self.assertFalse(template.materialized)
+        self.assertEqual(template.render({'c'}), 'line 1\nline 3\nline 5')
+
+        self.assertTrue(template.materialize(max_variants=8))
+        self.assertEqual(template.render({'c'}), 'line 1\nline 3\nline 5')
+
+    def test_cache_size(self):
+        # materialized before and after the first render
+        for render_first in (False, True):
+            template = compiles(self.TEMPLATE, cache_size=4)
+
+            if render_first:
+                template.render({'c'})
+
+            self.assertTrue(template.materialize())
+            self.assertEqual(template.render({'c'}), 'line 1\nline 3\nline 5')
+            self.assertIsNone(template.cache_info())
+            template.cache_clear()
+            self.assertEqual(template.render({'a'}), 'line 1\nline 2\nline 5')
+
+
+class TestRenderIter(TestCase):
+    def test_same_as_render(self):
+        for reference, template, symbols in render_cases():
+            self.assertEqual(''.join(template.render_iter(symbols)), reference.render(symbols))
+
+    def test_chunks(self):
+        template = compiles("""line 1
+#if a
+line 2
+    #if b
+line 3
+    #endif
+#endif
+line 4""")
+        self.assertEqual(list(template.render_iter({'a', 'b'})),
+                         ['line 1\n', 'line 2\n', 'line 3\n', 'line 4'])
+        self.assertEqual(list(template.render_iter({'a'})), ['line 1\n', 'line 2\n', 'line 4'])
+
+    def test_last_line_break(self):
+        template = compiles('line 1\n#if a\nline 2\n#endif\n')
+        self.assertEqual(list(template.render_iter({'a'})), ['line 1\n', 'line 2\n'])
+        self.assertEqual(list(template.render_iter(set())), ['line 1\n'])
+        self.assertEqual(list(compiles('').render_iter(set())), [])
+        self.assertEqual(list(compiles('\n').render_iter(set())), ['\n'])
+
+
+class TestRenderInto(TestCase):
+    def test_same_as_render(self):
+        for reference, template, symbols in render_cases(lazy=(False, True)):
+            out = StringIO()
+            self.assertEqual(template.render_into(out, symbols), len(reference.render(symbols)))
+            self.assertEqual(out.getvalue(), reference.render(symbols))
+
+    def test_writes(self):
+        template = compiles('line 1\n#if a\nline 2\n    #if b\nline 3\n    #endif\n#endif\nline 4\n')
+        writes = []
+
+        class Writer:
+            def write(self, text):
+                writes.append(text)
+
+        self.assertEqual(template.render_into(Writer(), {'a', 'b'}), 28)
+        self.assertEqual(writes, ['line 1\n', 'line 2\n', 'line 3\n', 'line 4\n'])
+
+    def test_reused_buffer(self):
+        template = compiles('#if a\nfoo\n#else\nbar\n#endif\nbaz')
+        out = StringIO()
+
+        for symbols, expected in (({'a'}, 'foo\nbaz'), (set(), 'bar\nbaz')):
+            out.seek(0)
+            out.truncate()
+            template.render_into(out, symbols)
+            self.assertEqual(out.getvalue(), expected)
+
+    def test_file(self):
+        template = compiles('line 1\n#if a\nline 2\n#endif')
+
+        with tempfile.TemporaryFile('w+') as f:
+            self.assertEqual(template.render_into(f, {'a'}), 13)
+            f.seek(0)
+            self.assertEqual(f.read(), 'line 1\nline 2')
+
+
+class TestBytes(TestCase):
+    def test_same_as_text(self):
+        for text in TEMPLATES + REDUNDANT_TEMPLATES:
+            data = text.encode('utf-8')
+
+            for engine in ENGINES:
+                for lazy in (False, True):
+                    expected = compiles(text, engine, lazy=lazy)
+                    template = compiles(data, engine, lazy=lazy)
+                    self.assertTrue(template.binary)
+
+                    for symbols in all_symbol_sets():
+                        self.assertEqual(template.render(symbols), expected.render(symbols).encode('utf-8'),
+                                         (text, engine, lazy, symbols))
+                        self.assertEqual(b''.join(template.render_iter(symbols)), template.render(symbols))
+
+    def test_sources(self):
+        data = b'line 1\r\n  #IF a\r\nl\xc3\xadnea 2\n#endif'
+
+        for source in (data, bytearray(data), memoryview(data)):
+            template = compiles(source)
+            self.assertEqual(template.render({'a'}), b'line 1\nl\xc3\xadnea 2')
+            self.assertEqual(template.render(set()), b'line 1')
+
+        template = compile([b'line 1\r\n', b'#if a\n', b'line 2\n', b'#endif\n'])
+        self.assertEqual(template.render({'a'}), b'line 1\nline 2')
+        self.assertEqual(compiles(b'').render(set()), b'')
+
+        with self.assertRaises(DirectiveSyntaxError):
+            compiles(b'#if caf\xe9\nx\n#endif')
+
+        # text outside directives is not decoded
+        self.assertEqual(compiles(b'caf\xe9\n#if a\nx\n#endif').render(set()), b'caf\xe9')
+
+    def test_text_blocks(self):
+        template = compiles(b'line 1\n#if a\nline 3\n#endif\nline 5', optimize=False)
+        self.assertEqual(template.blocks[0], TextBlock(b'line 1\n'))
+        self.assertEqual(template.blocks[1].entry_lines, [2])
+        self.assertEqual(template.specialize({'a'}).blocks, [TextBlock(b'line 1\nline 3\nline 5\n')])
+
+    def test_render_into(self):
+        template = compiles(b'line 1\n#if a\nline 2\n#endif\n')
+        buffer = bytearray(b'> ')
+
+        self.assertEqual(template.render_into(buffer, {'a'}), 14)
+        self.assertEqual(template.render_into(buffer, set()), 7)
+        self.assertEqual(buffer, b'> line 1\nline 2\nline 1\n')
+
+        out = BytesIO()
+        self.assertEqual(template.render_into(out, {'a'}), 14)
+        self.assertEqual(out.getvalue(), b'line 1\nline 2\n')
+
+        with self.assertRaises(ValueError):
+            compiles('line 1').render_into(bytearray(), set())
+
+    def test_render_into_writes_bytes(self):
+        template = compiles(b'line 1\n#if a\nline 2\n#endif\nline 3')
+        writes = []
+
+        class Writer:
+            def write(self, data):
+                writes.append(data)
+
+        self.assertEqual(template.render_into(Writer(), {'a'}), 20)
+        self.assertEqual(writes, [b'line 1\n', b'line 2\n', b'line 3'])
+        self.assertEqual([type(data) for data in writes], [bytes, bytes, bytes])
+
+    def test_features(self):
+        template = compiles(b'#if a\nfoo\n#elif b\nbar\n#endif', cache_size=4)
+        self.assertEqual(template.render({'b'}), b'bar')
+        self.assertEqual(template.render({'b', 'c'}), b'bar')
+        self.assertEqual(template.cache_info().hits, 1)
+        self.assertEqual(template.render_many([{'a'}, set()]), [b'foo', b''])
+        self.assertEqual(sorted(text for text, _ in template.variants()), [b'', b'bar', b'foo'])
+
+        template.start_profiling()
+        self.assertEqual(template.render({'a'}), b'foo')
+        template.stop_profiling()
+
+        self.assertTrue(template.materialize())
+        self.assertEqual(template.render({'a'}), b'foo')
+
+
+class TestLazy(TestCase):
+    def test_same_as_eager(self):
+        for reference, template, symbols in render_cases(lazy=(True, )):
+            self.assertEqual(template.render(symbols), reference.render(symbols))
+            self.assertEqual(''.join(template.render_iter(symbols)), reference.render(symbols))
+
+    def test_branches_parsed_on_first_use(self):
+        template = compiles("""line 1
+#if a
+    #if b and
+    #endif
+#else
+line 2
+#endif""", lazy=True)
+
+        conditional = template.blocks[1]
+        self.assertIsInstance(conditional, ConditionalBlock)
+        lazy_blocks = [blocks[0] for _, blocks in conditional.if_entries]
+        self.assertTrue(all(isinstance(block, LazyBlock) for block in lazy_blocks))
+        self.assertTrue(all(block._blocks is None for block in lazy_blocks))
+
+        self.assertEqual(template.render(set()), 'line 1\nline 2')
+        self.assertIsNone(lazy_blocks[0]._blocks)
+        self.assertIsNotNone(lazy_blocks[1]._blocks)
+
+        with self.assertRaises(ExpressionSyntaxError):
+            template.render({'a'})
+
+    def test_structure_errors(self):
+        templates = [
+            '#if foo',
+            '#if foo\n#else',
+            '#if foo\n#elif bar\n#else',
+            '#if foo\n#else\n#elif bar\n#endif',
+            '#if foo\n#else\n#else\n#endif',
+            '#if foo\n    #if bar\n#endif',
+            '#if\n#endif',
+            '#if foo\n#elif\n#endif',
+            '#endif',
+            '#else',
+            '#foo',
+            '#if foo\n    #foo\n#endif',
+            '#if a\n#if b\n#else\n#elif c\n#endif\n#endif',
+            '#if a\n#if b\n#else\n#else\n#endif\n#endif',
+            '#if a\n#else\n#if b\n#if c\n#else\n#elif d\n#endif\n#endif\n#endif',
+        ]
+
+        for text in templates:
+            with self.assertRaises(DirectiveSyntaxError, msg=text):
+                compiles(text)
+
+            with self.assertRaises(DirectiveSyntaxError, msg=text):
+                compiles(text, lazy=True)
+
+
+class TestCompileText(TestCase):
+    def test_line_breaks(self):
+        self.assertEqual(renders('line 1\r\n#if a\r\nline 2\r\n#endif\r\nline 3', {'a'}),
+                         'line 1\nline 2\nline 3')
+        self.assertEqual(renders('line 1\r\r\nline 2\r', set()), 'line 1\nline 2')
+        self.assertEqual(renders('line\r1\n', set()), 'line\r1\n')
+
+    def test_lines(self):
+        text = 'line 1\n  #if a\nline 2\n  #endif\nline 3\n'
+        self.assertEqual(compile(StringIO(text)).render({'a'}), 'line 1\nline 2\nline 3')
+        self.assertEqual(compile(text.split('\n')).render({'a'}), renders(text, {'a'}))
+        self.assertEqual(compile([]).render({'a'}), '')
+
+    def test_directive_at_end(self):
+        self.assertEqual(renders('line 1\n#if a\nline 2\n#endif', {'a'}), 'line 1\nline 2')
+        self.assertEqual(renders('line 1\n#if a\nline 2\n#endif', set()), 'line 1')
+        self.assertEqual(renders('line 1\n#if a\nline 2\n#endif\n', set()), 'line 1\n')
+
+    def test_long_text(self):
+        text = 'line\n' * 100000 + '#if a\n' + 'other line\n' * 100000 + '#endif'
+        template = compiles(text, optimize=False)
+        self.assertEqual(len(template.blocks), 3)
+        self.assertEqual(template.render({'a'}), text.replace('#if a\n', '')[:-len('\n#endif')])
+
+
+    def test_entry_lines(self):
+        text = 'line 1\n#if a\n#if b\nline 4\n#else\n#endif\n#elif c\nline 8\n#endif'
+
+        for lazy in (False, True):
+            template = compiles(text, lazy=lazy, optimize=False)
+            self.assertEqual(template.blocks[1].entry_lines, [2, 7])
+
+            inner_blocks = template.blocks[1].if_entries[0][1]
+            if lazy:
+                inner_blocks = inner_blocks[0].blocks
+
+            self.assertEqual(inner_blocks[0].entry_lines, [3, 5])
+
+        template = compiles('#if a\nline 2\n#elif a\n#elif b\nline 5\n#endif')
+        self.assertEqual(template.blocks[0].entry_lines, [1, 4])
+
+
+class TestCompiler(TestCase):
+    def test_prefixes(self):
+        sql = Compiler('#')
+        shell = Compiler('--#')
+
+        self.assertEqual(sql.compile_text('a\n#if x\nb\n#endif').render({'x'}), 'a\nb')
+        self.assertEqual(shell.compile_text('a\n--#IF x\nb\n--#endif').render(set()), 'a')
+        self.assertEqual(shell.compile_text('a\n#if x\nb\n#endif').render(set()), 'a\n#if x\nb\n#endif')
+        self.assertEqual(shell.compile(['a\n', '--#if x\n', 'b\n', '--#endif\n']).render({'x'}), 'a\nb')
+
+    def test_options(self):
+        compiler = Compiler('%', ENGINE_CODEGEN, cache_size=8, lazy=True)
+        template = compiler.compile_text('%if a\nfoo\n%endif')
+        self.assertEqual(template.engine, ENGINE_CODEGEN)
+        self.assertEqual(template.cache_size, 8)
+        self.assertIsInstance(template.blocks[0].if_entries[0][1][0], LazyBlock)
+
+        with self.assertRaises(ValueError):
+            Compiler('#', 'unknown')
+
+    def test_invalid_prefix(self):
+        for prefix in (None, 1, '# ', '#\n', '\u00e7'):
+            with self.assertRaises(ValueError):
+                Compiler(prefix)
+
+    def test_lazy_keeps_prefix(self):
+        template = compiles('#if a\n#if b\nfoo\n#endif\n#endif', lazy=True)
+
+        try:
+            set_directive_prefix('%')
+            self.assertEqual(template.render({'a', 'b'}), 'foo')
+
+        finally:
+            set_directive_prefix('#')
+
+    def test_concurrent(self):
+        compilers = [Compiler('#'), Compiler('--#'), Compiler('%%')]
+        barrier = threading.Barrier(len(compilers))
+        results = {}
+
+        def compile_many(compiler):
+            text = '\n'.join('{0}if a{1}\nline {1}\n{0}endif'.format(compiler.prefix, i) for i in range(200))
+            barrier.wait()
+
+            results[compiler.prefix] = [compiler.compile_text(text).render({'a7'}) for _ in range(20)]
+
+        threads = [threading.Thread(target=compile_many, args=(compiler,)) for compiler in compilers]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for compiler in compilers:
+            self.assertEqual(set(results[compiler.prefix]), {'line 7'})
+
+
+class TestCompilePath(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, data, name='template.txt'):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def test_same_as_compile(self):
+        for text in TEMPLATES + ['line 1\r\n#if a\r\nline 2\r\n#endif\r\n', 'áé\n\u00a0#if a\nç\n#endif',
+                                 'line 1\r#if a\rline 2\r#endif\r', 'line 1\r\r\n#if a\r\n\rline 2\r#endif\r\r']:
+            path = self._write(text.encode('utf-8'))
+
+            with open(path, encoding='utf-8') as f:
+                reference = compile(f)
+
+            for lazy in (False, True):
+                template = compile_path(path, lazy=lazy)
+
+                for symbols in all_symbol_sets():
+                    self.assertEqual(template.render(symbols), reference.render(symbols), (text, symbols))
+
+    def test_decoded_blocks(self):
+        path = self._write(b'line 1\r\n#if a\nline 2\n#endif\nline 3\n')
+        template = compile_path(path)
+        self.assertIs(type(template.blocks[0]), TextBlock)
+        self.assertEqual(template.blocks[0].text, 'line 1\n')
+        self.assertEqual(template.render({'a'}), 'line 1\nline 2\nline 3')
+
+    def test_mapped(self):
+        path = self._write(b'select a\n#if b\nwhere b\n#endif\norder by 1\n')
+
+        for lazy, calls in ((False, 1), (True, 0)):
+            with patch('mmap.mmap', wraps=mmap.mmap) as mapping:
+                template = compile_path(path, lazy=lazy)
+
+            self.assertEqual(mapping.call_count, calls)
+            self.assertEqual(template.render({'b'}), 'select a\nwhere b\norder by 1')
+
+    def test_file_changed(self):
+        path = self._write(b'select a\n#if b\nwhere b\n#endif\norder by 1\n')
+
+        for lazy in (False, True):
+            template = compile_path(path, lazy=lazy)
+
+            with open(path, 'r+b') as f:
+                f.write(b'SELECT B THERE')
+
+            self.assertEqual(template.render({'b'}), 'select a\nwhere b\norder by 1')
+
+            with open(path, 'r+b') as f:
+                f.truncate(3)
+
+            self.assertEqual(template.render({'b'}), 'select a\nwhere b\norder by 1')
+            path = self._write(b'select a\n#if b\nwhere b\n#endif\norder by 1\n')
+
+    def test_encodings(self):
+        text = 'línea 1\n#if a\nlínea 2\n#endif'
+        path = self._write(text.encode('latin-1'))
+        self.assertEqual(compile_path(path, encoding='latin-1').render({'a'}), 'línea 1\nlínea 2')
+
+        path = self._write(text.encode('utf-16'))
+        template = compile_path(path, encoding='utf-16')
+        self.assertEqual(template.render({'a'}), 'línea 1\nlínea 2')
+
+        with self.assertRaises(ValueError):
+            compile_path(path, encoding='utf-16', cache_dir=self.directory.name)
+
+        path = self._write('#if café\nx\n#endif'.encode('latin-1'))
+        for lazy in (False, True):
+            with self.assertRaises(DirectiveSyntaxError):
+                compile_path(path, lazy=lazy)
+
+    def test_empty(self):
+        self.assertEqual(compile_path(self._write(b'')).render(set()), '')
+
+    def test_compiler(self):
+        path = self._write(b'line 1\n--#if a\nline 3\n--#endif\n')
+        compiler = Compiler('--#')
+        self.assertEqual(compiler.compile_path(path).render({'a'}), 'line 1\nline 3')
+        self.assertEqual(compiler.compile_path(path, 'latin-1').render(set()), 'line 1')
+
+    def test_entry_lines(self):
+        path = self._write(b'line 1\n#if a\nline 3\n#elif b\n#endif\n')
+        self.assertEqual(compile_path(path, optimize=False).blocks[1].entry_lines, [2, 4])
+
+    def test_whitespace(self):
+        import sys
+        self.assertEqual(_WHITESPACE, ''.join(c for c in map(chr, range(sys.maxunicode + 1))
+                                              if c.isspace() and c != '\n'))
+
+
+class TestRenderMany(TestCase):
+    def test_render_many(self):
+        for text in TEMPLATES:
+            for engine in ENGINES:
+                template = compiles(text, engine)
+                symbols_sets = list(all_symbol_sets()) * 2
+
+                self.assertEqual(template.render_many(symbols_sets),
+                                 [template.render(symbols) for symbols in symbols_sets])
+
+    def test_shared_outputs(self):
+        template = compiles('#if a\nfoo\n#else\nbar\n#endif\n')
+        symbols_sets = [{'a', 'x'}, ['a'], {'b': 1}, {'a': 1, 'y': 2}, set()]
+        result = template.render_many(symbols_sets)
+
+        self.assertEqual(result, ['foo\n', 'foo\n', 'bar\n', 'foo\n', 'bar\n'])
+        self.assertIs(result[0], result[3])
+        self.assertIs(result[2], result[4])
+
+    def test_iter_render_many(self):
+        template = compiles('#if a\nfoo\n#endif')
+        iterator = template.iter_render_many(({'a'} for _ in range(3)))
+        self.assertEqual(next(iterator), 'foo')
+        self.assertEqual(list(iterator), ['foo', 'foo'])
+
+
+class TestOptimize(TestCase):
+    def assertSameRenders(self, text, symbols='abcde'):
+        for expected, template, symbols_set in render_cases([text], lazy=(False, True), symbols=symbols):
+            self.assertEqual(template.render(symbols_set), expected.render(symbols_set),
+                             (text, template.engine, symbols_set))
+
+    def test_same_renders(self):
+        for text in TEMPLATES + REDUNDANT_TEMPLATES:
+            self.assertSameRenders(text)
+
+    def test_random_templates(self):
+        random = Random(0)
+
+        for _ in range(200):
+            self.assertSameRenders('\n'.join(random_template(random)), 'abcd')
+
+    def test_expressions(self):
+        template = compiles(REDUNDANT_TEMPLATES[0])
+        self.assertEqual(template.blocks[1].if_entries[0][0], Id('a'))
+
+        template = compiles(REDUNDANT_TEMPLATES[1])
+        self.assertEqual([expression for expression, _ in template.blocks[0].if_entries], [Id('a')])
+
+    def test_covered_entries(self):
+        template = compiles(REDUNDANT_TEMPLATES[2])
+        self.assertEqual([expression for expression, _ in template.blocks[0].if_entries],
+                         [Id('a'), TrueNode()])
+
+        template = compiles(REDUNDANT_TEMPLATES[5])
+        self.assertEqual(len(template.blocks[0].if_entries), 1)
+
+    def test_inlined(self):
+        template = compiles(REDUNDANT_TEMPLATES[3])
+        self.assertEqual(template.blocks, [TextBlock('line 1\nline 3\n\n')])
+
+        template = compiles(REDUNDANT_TEMPLATES[4])
+        self.assertEqual(len(template.blocks), 1)
+        self.assertEqual(len(template.blocks[0].if_entries), 1)
+
+        self.assertEqual(compiles('#if a\n#endif').blocks, [])
+        self.assertEqual(compiles('#if a\n#endif').render({'a'}), '')
+
+    def test_text_merged(self):
+        template = compiles('line 1\n#if a or not a\nline 2\n#endif\nline 3\n#if b\nline 4\n#endif')
+        self.assertEqual(template.blocks[0], TextBlock('line 1\nline 2\nline 3\n'))
+
+    def test_not_modified(self):
+        template = compiles(REDUNDANT_TEMPLATES[2], optimize=False)
+        blocks = repr(template.blocks)
+        optimize_blocks(template.blocks)
+        self.assertEqual(repr(template.blocks), blocks)
+
+    def test_same_as_optimize_blocks(self):
+        # compile optimizes each conditional while parsing
+        random = Random(2)
+        texts = TEMPLATES + REDUNDANT_TEMPLATES + ['\n'.join(random_template(random)) for _ in range(50)]
+
+        for text in texts:
+            self.assertEqual(compiles(text).blocks, optimize_blocks(compiles(text, optimize=False).blocks), text)
+
+    def test_truth_tables(self):
+        # only entries that test the symbols of the entries before them can be
+        # covered by them
+        with patch('ppdpy.template_compiler.truth_table', wraps=truth_table) as table:
+            compiles('#if a and not b\nx\n#elif c\ny\n#else\nz\n#endif\n#if a or a\nx\n#endif')
+            self.assertEqual(table.call_count, 0)
+
+            compiles(REDUNDANT_TEMPLATES[2])
+            self.assertGreater(table.call_count, 0)
+
+
+class TestSpecialize(TestCase):
+    def assertSpecialized(self, text, known_true, known_false, symbols='abcde'):
+        def _specialize(template):
+            specialized = template.specialize(known_true, known_false)
+            self.assertEqual(specialized.engine, template.engine)
+            return specialized
+
+        for expected, template, symbols_set in render_cases([text], lazy=(False, True), symbols=symbols,
+                                                             prepare=_specialize):
+            given = (symbols_set - set(known_false)) | set(known_true)
+            self.assertEqual(template.render(symbols_set), expected.render(given),
+                             (text, template.engine, symbols_set))
+
+    def test_same_renders(self):
+        for text in TEMPLATES + REDUNDANT_TEMPLATES:
+            self.assertSpecialized(text, {'a'}, {'b'})
+            self.assertSpecialized(text, {'c', 'e'}, ())
+            self.assertSpecialized(text, (), {'a', 'd'})
+
+    def test_random_templates(self):
+        random = Random(1)
+
+        for _ in range(100):
+            text = '\n'.join(random_template(random))
+            self.assertSpecialized(text, {'a'}, {'c'}, 'abcd')
+
+    def test_folded(self):
+        text = 'line 1\n#if a and b\nline 2\n#elif c\nline 3\n#endif\nline 4'
+
+        template = compiles(text).specialize(known_true={'a', 'b'})
+        self.assertEqual(template.blocks, [TextBlock('line 1\nline 2\nline 4\n')])
+
+        template = compiles(text).specialize(known_false={'a'})
+        self.assertEqual(template.referenced_symbols, {'c'})
+        self.assertEqual(template.render({'c'}), 'line 1\nline 3\nline 4')
+
+    def test_original_unchanged(self):
+        template = compiles('#if a\nline 1\n#else\nline 2\n#endif')
+        template.specialize({'a'})
+        self.assertEqual(template.render(set()), 'line 2')
+
+    def test_conflicting(self):
+        with self.assertRaises(ValueError):
+            compiles('#if a\n#endif').specialize({'a', 'b'}, {'b'})
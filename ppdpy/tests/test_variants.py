@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from random import Random
+
+from ppdpy import compiles
+from ppdpy.tests.helpers import TEMPLATES, REDUNDANT_TEMPLATES, all_symbol_sets, random_template
+
+
+class TestVariants(TestCase):
+    def assertVariants(self, text, lazy=False):
+        template = compiles(text, lazy=lazy)
+        symbols = sorted(template.referenced_symbols)
+
+        expected = {}
+        for symbols_set in all_symbol_sets(symbols):
+            expected.setdefault(template.render(symbols_set), []).append(symbols_set)
+
+        variants = list(template.variants())
+        self.assertEqual(sorted(text for text, _ in variants), sorted(expected), text)
+
+        for text, symbols_set in variants:
+            self.assertEqual(template.render(symbols_set), text)
+            # a smallest symbols set
+            self.assertEqual(len(symbols_set), min(len(s) for s in expected[text]))
+
+        sizes = [len(symbols_set) for _, symbols_set in variants]
+        self.assertEqual(sizes, sorted(sizes))
+
+    def test_same_outputs(self):
+        for text in TEMPLATES + REDUNDANT_TEMPLATES:
+            self.assertVariants(text)
+            self.assertVariants(text, lazy=True)
+
+    def test_random_templates(self):
+        random = Random(2)
+
+        for _ in range(100):
+            self.assertVariants('\n'.join(random_template(random)))
+
+    def test_no_conditionals(self):
+        self.assertEqual(list(compiles('foo\nbar').variants()), [('foo\nbar', frozenset())])
+        self.assertEqual(list(compiles('').variants()), [('', frozenset())])
+
+    def test_many_symbols(self):
+        # 2^60 assignments, but only 61 distinct outputs
+        symbols = ['s{}'.format(i) for i in range(60)]
+        text = '\n'.join('#if {}\n{}\n#endif'.format(' and '.join(symbols[:i + 1]), i) for i in range(60))
+
+        variants = list(compiles(text, optimize=False).variants())
+        self.assertEqual(len(variants), 61)
+        self.assertEqual(variants[0], ('', frozenset()))
+        self.assertEqual(variants[-1][1], frozenset(symbols))
+
+    def test_long_condition(self):
+        symbols = ['s{}'.format(i) for i in range(3000)]
+        template = compiles('#if {}\nx\n#endif'.format(' or '.join(symbols)))
+
+        self.assertEqual(list(template.variants()), [('', frozenset()), ('x', frozenset({'s0'}))])
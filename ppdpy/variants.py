@@ -0,0 +1,244 @@
+"""
+Enumeration of the distinct outputs of a template.
+
+The output of a template is built as a reduced, ordered multi-terminal
+decision diagram: each inner node tests a symbol, and each terminal is a
+rendered text. Assignments that render the same text reach the same
+terminal, so the distinct outputs are read from the terminals without
+rendering every assignment of the symbols.
+"""
+from ppdpy.expression_compiler import Id, Not, And, Or, TrueNode, FalseNode
+from ppdpy.template_compiler import TextBlock, ConditionalBlock, LazyBlock, \
+    LINEBREAK, referenced_symbols
+
+
+class _Diagram:
+    """
+    The shared nodes of a set of decision diagrams. Nodes are integers: the
+    terminals hold a value (a boolean for conditions, a text for outputs),
+    and the inner nodes test the symbol of index `level`, going to `low` when
+    it is false and to `high` when it is true. Nodes are unique: there are no
+    two nodes with the same contents.
+    """
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.symbol_levels = {symbol: level for level, symbol in enumerate(symbols)}
+        # the terminals level is after every symbol
+        self.levels = []
+        self.lows = []
+        self.highs = []
+        self.values = []
+        self._unique = {}
+        self._apply_cache = {}
+
+    def terminal(self, value):
+        return self._node(len(self.symbols), None, None, value)
+
+    def node(self, level, low, high):
+        if low == high:
+            return low
+
+        return self._node(level, low, high, None)
+
+    def _node(self, level, low, high, value):
+        key = (level, low, high, value)
+        node = self._unique.get(key)
+
+        if node is None:
+            node = self._unique[key] = len(self.levels)
+            self.levels.append(level)
+            self.lows.append(low)
+            self.highs.append(high)
+            self.values.append(value)
+
+        return node
+
+    def apply(self, operation, *operands):
+        """
+        Combines diagrams, applying `operation` to the values of the
+        terminals they reach for each assignment. The diagrams are walked
+        with an explicit stack, as they can be as deep as there are symbols.
+        """
+        cache = self._apply_cache
+        levels = self.levels
+        terminals_level = len(self.symbols)
+        root = (operation, operands)
+        stack = [root]
+
+        while stack:
+            key = stack[-1]
+
+            if key in cache:
+                stack.pop()
+                continue
+
+            nodes = key[1]
+            level = min(levels[node] for node in nodes)
+
+            if level == terminals_level:
+                stack.pop()
+                cache[key] = self.terminal(operation(*[self.values[node] for node in nodes]))
+                continue
+
+            low = (operation, tuple(self.lows[node] if levels[node] == level else node for node in nodes))
+            high = (operation, tuple(self.highs[node] if levels[node] == level else node for node in nodes))
+
+            pending = [child for child in (low, high) if child not in cache]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            cache[key] = self.node(level, cache[low], cache[high])
+
+        return cache[root]
+
+    def condition(self, expression, cache):
+        """
+        The diagram of an expression, whose terminals are booleans. The
+        expression tree is walked with an explicit stack, as long generated
+        conditions are deep.
+        """
+        stack = [expression]
+
+        while stack:
+            item = stack[-1]
+
+            if item in cache:
+                stack.pop()
+                continue
+
+            if isinstance(item, Not):
+                operands = [item.node]
+
+            elif isinstance(item, (And, Or)):
+                operands = [item.left, item.right]
+
+            elif isinstance(item, Id):
+                level = self.symbol_levels[item.id]
+                cache[stack.pop()] = self.node(level, self.terminal(False), self.terminal(True))
+                continue
+
+            elif isinstance(item, (TrueNode, FalseNode)):
+                cache[stack.pop()] = self.terminal(isinstance(item, TrueNode))
+                continue
+
+            else:
+                raise ValueError('unexpected expression type')
+
+            pending = [operand for operand in operands if operand not in cache]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            operation = _not if isinstance(item, Not) else _and if isinstance(item, And) else _or
+            cache[item] = self.apply(operation, *[cache[operand] for operand in operands])
+
+        return cache[expression]
+
+    def output(self, blocks, cache, empty):
+        """
+        The diagram of the text rendered by a block list, where `empty` is the
+        empty text ('' or b'').
+        """
+        result = self.terminal(empty)
+
+        for block in blocks:
+            if isinstance(block, TextBlock):
+                text = block.text
+                if text:
+                    result = self.apply(_concat, result, self.terminal(text))
+
+            elif isinstance(block, ConditionalBlock):
+                # the text of no entry, then of each entry from the last one
+                selected = self.terminal(empty)
+
+                for expression, inner_blocks in reversed(block.if_entries):
+                    selected = self.apply(_select, self.condition(expression, cache),
+                                          self.output(inner_blocks, cache, empty), selected)
+
+                result = self.apply(_concat, result, selected)
+
+            elif isinstance(block, LazyBlock):
+                result = self.apply(_concat, result, self.output(block.blocks, cache, empty))
+
+            else:
+                raise ValueError('unexpected block type')
+
+        return result
+
+
+def _not(value):
+    return not value
+
+
+def _and(left, right):
+    return left and right
+
+
+def _or(left, right):
+    return left or right
+
+
+def _concat(left, right):
+    return left + right
+
+
+def _select(condition, selected, otherwise):
+    return selected if condition else otherwise
+
+
+def variants(template):
+    """
+    Yields each distinct text the template can render once, as (text,
+    symbols) pairs, where `symbols` is a smallest set of symbols that renders
+    it. The texts are yielded from the smallest symbols sets to the largest.
+    """
+    symbols = referenced_symbols(template.blocks)
+    diagram = _Diagram(symbols)
+    root = diagram.output(template.blocks, {}, b'' if template.binary else '')
+
+    # walks the diagram level by level (every edge goes to a greater level),
+    # keeping the path to each node with the fewest true symbols
+    best = {root: (0, 0)}
+    levels = diagram.levels
+
+    for node in sorted(_reachable(diagram, root), key=levels.__getitem__):
+        if levels[node] == len(symbols):
+            continue
+
+        count, mask = best[node]
+        bit = 1 << levels[node]
+
+        for child, child_path in ((diagram.lows[node], (count, mask)),
+                                  (diagram.highs[node], (count + 1, mask | bit))):
+            if child not in best or child_path < best[child]:
+                best[child] = child_path
+
+    terminals = sorted((path, node) for node, path in best.items() if levels[node] == len(symbols))
+    seen = set()
+
+    for (_, mask), node in terminals:
+        # drops the line break of the last line, like render does
+        text = diagram.values[node][:-len(LINEBREAK)]
+
+        if text not in seen:
+            seen.add(text)
+            yield text, frozenset(symbol for i, symbol in enumerate(symbols) if mask & 1 << i)
+
+
+def _reachable(diagram, root):
+    found = {root}
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+
+        if diagram.lows[node] is not None:
+            for child in (diagram.lows[node], diagram.highs[node]):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+
+    return found